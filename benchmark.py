@@ -0,0 +1,425 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Callable, Tuple
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+
+from standalone_parser import CLRParser
+
+BENCHMARK_FORMAT_VERSION = 1
+
+# Build phases recorded by CLRParser.initialize_parser, in order
+BUILD_PHASES = ('parse_grammar', 'first_follow', 'states', 'table')
+
+class GrammarFamily(NamedTuple):
+    """A scalable grammar: productions for a size, and random accepted sentences of a length"""
+    grammar: Callable[[int], List[str]]
+    sentence: Callable[[int, int, random.Random], List[str]]
+    sizes: Tuple[int, ...]
+
+# Every family is a token grammar, so sizes are not limited by the 26
+# single-letter non-terminals, and sentences are space-separated tokens
+
+def expression_grammar(levels):
+    """Left-associative binary operators o0..o{levels-1}, one precedence level each, over numbers and parentheses"""
+    grammar = ['%token num \\d+', '%skip \\s+']
+    for level in range(levels):
+        grammar.append(f"E{level} -> E{level} o{level} E{level + 1}")
+        grammar.append(f"E{level} -> E{level + 1}")
+    grammar += [f"E{levels} -> ( E0 )", f"E{levels} -> num"]
+    return grammar
+
+def expression_sentence(levels, length, rng):
+    """An expression of about `length` tokens with random operators and nesting"""
+    tokens, depth = [], 0
+    while True:
+        while rng.random() < 0.15 and len(tokens) < length:
+            tokens.append('(')
+            depth += 1
+        tokens.append(str(rng.randrange(1000)))
+        while depth and rng.random() < 0.3:
+            tokens.append(')')
+            depth -= 1
+        if len(tokens) >= length:
+            break
+        tokens.append(f"o{rng.randrange(levels)}")
+    return tokens + [')'] * depth
+
+def chain_grammar(depth, right):
+    """A list of chains a0 a1 .. a{depth-1}, each parsed through `depth` non-terminals"""
+    grammar = ['%skip \\s+', 'L -> N0 L' if right else 'L -> L N0', 'L -> N0']
+    for i in range(depth - 1):
+        grammar.append(f"N{i} -> a{i} N{i + 1}" if right else f"N{i} -> N{i + 1} a{i}")
+    grammar.append(f"N{depth - 1} -> a{depth - 1}")
+    return grammar
+
+def chain_sentence(depth, length, rng, right):
+    """Whole chains, about `length` tokens in all"""
+    chain = [f"a{i}" for i in range(depth)] if right else [f"a{i}" for i in reversed(range(depth))]
+    return chain * max(1, length // depth)
+
+def nullable_grammar(width):
+    """Statements of `width` optional symbols a0..a{width-1}, each ended by ';'"""
+    grammar = ['%skip \\s+', 'L -> L S', 'L -> S', 'S -> ' + ' '.join(f"A{i}" for i in range(width)) + ' ;']
+    for i in range(width):
+        grammar += [f"A{i} -> a{i}", f"A{i} ->"]
+    return grammar
+
+def nullable_sentence(width, length, rng):
+    """Statements with a random subset of the optional symbols present"""
+    tokens = []
+    while len(tokens) < length:
+        tokens += [f"a{i}" for i in range(width) if rng.random() < 0.5] + [';']
+    return tokens
+
+def alternation_grammar(width):
+    """Lists of one of `width` words w0..w{width-1}, or of a parenthesized list"""
+    grammar = ['%skip \\s+', 'L -> L S', 'L -> S', 'S -> ( L )']
+    grammar += [f"S -> w{i}" for i in range(width)]
+    return grammar
+
+def alternation_sentence(width, length, rng):
+    """Random words with balanced parentheses"""
+    tokens, depth = [], 0
+    while len(tokens) < length:
+        if rng.random() < 0.1:
+            tokens.append('(')
+            depth += 1
+        tokens.append(f"w{rng.randrange(width)}")
+        if depth and rng.random() < 0.1:
+            tokens.append(')')
+            depth -= 1
+    return tokens + [')'] * depth
+
+FAMILIES = OrderedDict([
+    ('expression', GrammarFamily(expression_grammar, expression_sentence, (2, 4, 8, 16, 32))),
+    ('left_chain', GrammarFamily(lambda depth: chain_grammar(depth, right=False),
+                                 lambda depth, length, rng: chain_sentence(depth, length, rng, right=False),
+                                 (4, 16, 64, 256))),
+    ('right_chain', GrammarFamily(lambda depth: chain_grammar(depth, right=True),
+                                  lambda depth, length, rng: chain_sentence(depth, length, rng, right=True),
+                                  (4, 16, 64, 256))),
+    ('nullable', GrammarFamily(nullable_grammar, nullable_sentence, (4, 8, 16, 32, 64))),
+    ('alternation', GrammarFamily(alternation_grammar, alternation_sentence, (16, 64, 256))),
+])
+
+DEFAULT_LENGTHS = (100, 1000, 10000)
+
+def best_time(function, repeat):
+    """The fastest of `repeat` calls to function, in seconds, and the last return value"""
+    best, value = float('inf'), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        value = function()
+        best = min(best, time.perf_counter() - started)
+    return best, value
+
+def peak_memory(function):
+    """Peak memory traced by tracemalloc during a call to function, in bytes"""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def benchmark_build(grammar, mode, repeat):
+    """Best time of each build phase over `repeat` builds, the build's peak memory, and its sizes"""
+    phases = OrderedDict((phase, float('inf')) for phase in BUILD_PHASES)
+    for _ in range(repeat):
+        parser = CLRParser()
+        parser.initialize_parser(grammar, mode=mode)
+        for phase in BUILD_PHASES:
+            phases[phase] = min(phases[phase], parser.build_timings.get(phase, 0.0))
+    phases['total'] = sum(phases[phase] for phase in BUILD_PHASES)
+    
+    result = OrderedDict([('build', phases),
+                          ('build_peak_bytes', peak_memory(lambda: CLRParser().initialize_parser(grammar, mode=mode)))])
+    stats = parser.get_build_stats()
+    for key in ('states', 'items', 'closure_calls', 'closure_cache_hits'):
+        result[key] = stats[key]
+    result['conflicts'] = parser.count_conflicts()
+    return parser, result
+
+def benchmark_edit(parser, repeat):
+    """Best time to recompile after adding one production, for the head of the last production, with a new terminal"""
+    head = parser.grammar[-1].split('->', 1)[0].strip()
+    seconds, edited = best_time(lambda: parser.recompile(added=[f"{head} -> edited"]), repeat)
+    return OrderedDict([('seconds', seconds), ('reused_states', edited.reused_states),
+                        ('reused_closures', edited.reused_closures)])
+
+def benchmark_minimize(grammar, mode, tokens):
+    """Table sizes before and after minimizing with unit rules bypassed, and the driver steps for one sentence"""
+    parser = CLRParser()
+    parser.initialize_parser(grammar, mode=mode, unit_rules=True)
+    result = parser.parse(' '.join(tokens))
+    if not result.accepted:
+        raise ValueError(f"Minimized table rejected a generated sentence at offset {result.error_position}")
+    stats = parser.minimize_stats
+    return OrderedDict([('seconds', parser.build_timings['minimize']), ('before', stats['before']),
+                        ('after', stats['after']), ('steps', result.step_count)])
+
+def benchmark_parse(parser, tokens, repeat):
+    """Best times to recognize, trace and build the tree of one sentence, and the trace's peak memory"""
+    text = ' '.join(tokens)
+    recognize, result = best_time(lambda: parser.parse(text), repeat)
+    if not result.accepted:
+        raise ValueError(f"Generated sentence rejected at offset {result.error_position}")
+    trace, _ = best_time(lambda: parser.parse(text, trace=True), repeat)
+    tree, _ = best_time(lambda: parser.parse(text, tree=True), repeat)
+    
+    return OrderedDict([
+        ('tokens', len(tokens)),
+        ('steps', result.step_count),
+        ('recognize', recognize),
+        ('trace', trace),
+        ('tree', tree),
+        ('tokens_per_second', len(tokens) / recognize if recognize else None),
+        ('trace_peak_bytes', peak_memory(lambda: parser.parse(text, trace=True)))
+    ])
+
+def run_benchmarks(families=None, sizes=None, modes=('clr', 'lalr'), lengths=DEFAULT_LENGTHS,
+                   repeat=3, seed=0, log=None):
+    """Benchmark every family, size and mode; returns the JSON-ready results"""
+    cases = OrderedDict()
+    for name in families or FAMILIES:
+        family = FAMILIES[name]
+        for size in sizes or family.sizes:
+            grammar = family.grammar(size)
+            sentences = [family.sentence(size, length, random.Random(f"{seed}/{name}/{size}/{length}"))
+                         for length in lengths]
+            for mode in modes:
+                key = f"{name}/{size}/{mode}"
+                parser, case = benchmark_build(grammar, mode, repeat)
+                case['edit'] = benchmark_edit(parser, repeat)
+                case['minimize'] = benchmark_minimize(grammar, mode, sentences[-1])
+                case['parse'] = OrderedDict((str(length), benchmark_parse(parser, tokens, repeat))
+                                            for length, tokens in zip(lengths, sentences))
+                cases[key] = case
+                if log:
+                    longest = case['parse'][str(lengths[-1])]
+                    log(f"{key}: {case['states']} states, build {case['build']['total'] * 1000:.1f} ms, "
+                        f"edit {case['edit']['seconds'] * 1000:.1f} ms, {longest['tokens_per_second']:,.0f} tokens/s")
+    
+    return OrderedDict([
+        ('version', BENCHMARK_FORMAT_VERSION),
+        ('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('repeat', repeat),
+        ('seed', seed),
+        ('cases', cases)
+    ])
+
+def regression_metrics(case):
+    """The (name, value) pairs of a case that must not grow: times in seconds and peak bytes"""
+    for phase, seconds in case['build'].items():
+        yield f"build.{phase}", seconds
+    yield 'build_peak_bytes', case['build_peak_bytes']
+    if 'edit' in case:
+        yield 'edit', case['edit']['seconds']
+    if 'minimize' in case:
+        yield 'minimize', case['minimize']['seconds']
+    for length, parse in case['parse'].items():
+        for metric in ('recognize', 'trace', 'tree', 'trace_peak_bytes'):
+            yield f"parse.{length}.{metric}", parse[metric]
+
+def compare_results(results, baseline, threshold=0.25, min_seconds=0.001):
+    """Metrics of `results` more than `threshold` (a fraction) worse than `baseline`
+    
+    Returns a list of (case, metric, baseline value, new value). Times under
+    min_seconds in both runs are too noisy to compare and are skipped, as
+    are cases missing from either run.
+    """
+    regressions = []
+    for key, case in results['cases'].items():
+        base_case = baseline['cases'].get(key)
+        if base_case is None:
+            continue
+        base_metrics = dict(regression_metrics(base_case))
+        for metric, value in regression_metrics(case):
+            base = base_metrics.get(metric)
+            if base is None or value is None:
+                continue
+            if not metric.endswith('_bytes') and max(base, value) < min_seconds:
+                continue
+            if value > base * (1 + threshold):
+                regressions.append((key, metric, base, value))
+    return regressions
+
+def free_port():
+    """An unused local TCP port"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(port, timeout=30.0):
+    """Start the app under uvicorn in a subprocess and wait until it answers"""
+    process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'server:app', '--host', '127.0.0.1',
+                                '--port', str(port), '--log-level', 'warning'],
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api", timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"Server did not start within {timeout:g}s")
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+def run_load(url, bodies, requests=200, concurrency=8):
+    """POST `requests` bodies (cycling through `bodies`) to url from `concurrency` threads
+    
+    Returns the latency percentiles in seconds, the request rate, the error
+    count and how often the grammar cache was hit.
+    """
+    payloads = [json.dumps(body).encode('utf-8') for body in bodies]
+    
+    def send(index):
+        request = urllib.request.Request(url, data=payloads[index % len(payloads)],
+                                         headers={'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return time.perf_counter() - started, response.headers.get('X-Grammar-Cache')
+        except urllib.error.URLError:
+            return time.perf_counter() - started, None
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(send, range(requests)))
+    elapsed = time.perf_counter() - started
+    
+    latencies = sorted(latency for latency, cache in outcomes if cache is not None)
+    cache_statuses = [cache for latency, cache in outcomes if cache is not None]
+    result = OrderedDict([
+        ('requests', requests),
+        ('concurrency', concurrency),
+        ('errors', requests - len(latencies)),
+        ('requests_per_second', requests / elapsed),
+        ('cache_hits', cache_statuses.count('hit'))
+    ])
+    if latencies:
+        for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+            result[name] = percentile(latencies, fraction)
+        result['max'] = latencies[-1]
+    return result
+
+def load_bodies(family, size, length, inputs, seed):
+    """/parse request bodies with one grammar and `inputs` different sentences"""
+    grammar = FAMILIES[family].grammar(size)
+    rng = random.Random(f"{seed}/{family}/{size}/load")
+    return [{'grammar': grammar, 'input_string': ' '.join(FAMILIES[family].sentence(size, length, rng)),
+             'fields': ['is_accepted', 'state_count']} for _ in range(inputs)]
+
+def write_json(data, path):
+    """Write results to a file, or to stdout for '-'"""
+    text = json.dumps(data, indent=2)
+    if path == '-':
+        print(text)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+def main(argv=None):
+    """Command-line entry point: python -m benchmark run|compare|load|grammar"""
+    arg_parser = argparse.ArgumentParser(prog='python -m benchmark', description='CLR(1) parser benchmarks')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+    
+    run_cmd = commands.add_parser('run', help='time table construction and parsing on synthetic grammars')
+    run_cmd.add_argument('-o', '--output', default='-', help="results file (default: '-', stdout)")
+    run_cmd.add_argument('--family', action='append', choices=list(FAMILIES), help='grammar family (repeatable)')
+    run_cmd.add_argument('--size', action='append', type=int, help='family size (repeatable)')
+    run_cmd.add_argument('--mode', action='append', choices=['clr', 'lalr'], help='table mode (repeatable)')
+    run_cmd.add_argument('--length', action='append', type=int, help='sentence length in tokens (repeatable)')
+    run_cmd.add_argument('--repeat', type=int, default=3, help='runs per measurement; the fastest is kept')
+    run_cmd.add_argument('--seed', type=int, default=0, help='seed for the generated sentences')
+    run_cmd.add_argument('--baseline', help='compare against this results file and fail on regressions')
+    run_cmd.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, as a fraction')
+    
+    compare_cmd = commands.add_parser('compare', help='compare a results file against a baseline')
+    compare_cmd.add_argument('results', help='results file')
+    compare_cmd.add_argument('baseline', help='baseline results file')
+    compare_cmd.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, as a fraction')
+    
+    load_cmd = commands.add_parser('load', help='measure /parse latency under concurrent requests')
+    load_cmd.add_argument('--url', help='server base URL (default: start a local uvicorn server)')
+    load_cmd.add_argument('--family', choices=list(FAMILIES), default='expression', help='grammar family')
+    load_cmd.add_argument('--size', type=int, default=4, help='family size')
+    load_cmd.add_argument('--length', type=int, default=1000, help='sentence length in tokens')
+    load_cmd.add_argument('--inputs', type=int, default=16, help='number of different sentences')
+    load_cmd.add_argument('--requests', type=int, default=200, help='total requests')
+    load_cmd.add_argument('--concurrency', type=int, default=8, help='requests in flight at once')
+    load_cmd.add_argument('--seed', type=int, default=0, help='seed for the generated sentences')
+    load_cmd.add_argument('-o', '--output', default='-', help="results file (default: '-', stdout)")
+    
+    grammar_cmd = commands.add_parser('grammar', help='print a generated grammar, one production per line')
+    grammar_cmd.add_argument('family', choices=list(FAMILIES), help='grammar family')
+    grammar_cmd.add_argument('size', type=int, help='family size')
+    
+    args = arg_parser.parse_args(argv)
+    
+    if args.command == 'grammar':
+        print('\n'.join(FAMILIES[args.family].grammar(args.size)))
+        return 0
+    
+    if args.command == 'load':
+        server = None
+        url = args.url
+        if url is None:
+            port = free_port()
+            server = start_server(port)
+            url = f"http://127.0.0.1:{port}"
+        try:
+            result = run_load(url.rstrip('/') + '/parse',
+                              load_bodies(args.family, args.size, args.length, args.inputs, args.seed),
+                              args.requests, args.concurrency)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+        write_json(result, args.output)
+        return 0
+    
+    if args.command == 'run':
+        results = run_benchmarks(args.family, args.size, tuple(args.mode or ('clr', 'lalr')),
+                                 tuple(args.length or DEFAULT_LENGTHS), args.repeat, args.seed,
+                                 log=lambda line: print(line, file=sys.stderr))
+        write_json(results, args.output)
+        if args.baseline is None:
+            return 0
+        baseline_path = args.baseline
+    else:
+        with open(args.results, encoding='utf-8') as f:
+            results = json.load(f)
+        baseline_path = args.baseline
+    
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare_results(results, baseline, args.threshold)
+    for key, metric, base, value in regressions:
+        print(f"REGRESSION {key} {metric}: {base:.6g} -> {value:.6g} (+{(value / base - 1) * 100:.0f}%)",
+              file=sys.stderr)
+    print(f"{len(regressions)} regressions above {args.threshold:.0%}", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,31 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Set
+from typing import List, Dict, Any, Set, Literal, Optional
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import codecs
+import cProfile
+import gzip
+import threading
+import time
 import uvicorn
 import json
 import os
+import tempfile
 
-from standalone_parser import CLRParser
+from standalone_parser import (CLRParser, GRAMMAR_RESULT_FIELDS, RESULT_FIELDS, compile_grammar,
+                               grammar_fingerprint)
+
+try:
+    import orjson   # optional: a faster JSON encoder
+except ImportError:
+    orjson = None
 
 # Custom JSON encoder for handling sets and other non-serializable types
 class CustomJSONEncoder(json.JSONEncoder):
@@ -18,15 +34,227 @@ class CustomJSONEncoder(json.JSONEncoder):
             return list(obj)
         return super().default(obj)
 
+# Trace steps are bounded in size (TRACE_WINDOW), so capping their number
+# bounds a /parse trace; requests may ask for up to MAX_TRACE_STEPS
+DEFAULT_TRACE_STEPS = 1000
+MAX_TRACE_STEPS = 100000
+
 # Request model
 class ParserRequest(BaseModel):
     grammar: List[str] = Field(..., description="List of grammar productions (e.g. ['S->CC', 'C->cC', 'C->d'])")
     input_string: str = Field(..., description="Input string to be parsed")
+    mode: Literal['clr', 'lalr'] = Field('clr', description="Table construction mode: canonical CLR(1) or LALR(1)")
+    compare_modes: bool = Field(False, description="Also report the CLR(1)/LALR(1) state-count reduction and new conflicts")
+    max_steps: int = Field(DEFAULT_TRACE_STEPS, ge=1, le=MAX_TRACE_STEPS,
+                           description="Keep at most this many parsing steps in the trace")
+    build_tree: bool = Field(False, description="Also return the parse tree of an accepted input, as flat node arrays")
+    glr: bool = Field(False, description="Also parse with the GLR driver, which follows every conflicting action")
+    timings: bool = Field(False, description="Also return per-phase timings (in milliseconds) and table sizes")
+    fields: Optional[List[Literal[RESULT_FIELDS]]] = Field(None, description="Only return these result fields")
+    table_format: Literal['dict', 'compact'] = Field('dict', description="parse_table as a {state: {symbol: action}} "
+                                                     "dict, or as symbol lists plus integer action and goto rows")
+
+class BuildPool:
+    """Runs table construction off the event loop, with a timeout and a bounded queue"""
+    def __init__(self, kind='process', workers=None, timeout=30.0, max_queue=32):
+        if kind not in ('process', 'thread'):
+            raise ValueError(f"Unknown executor kind: {kind!r} (expected 'process' or 'thread')")
+        self.kind = kind
+        self.workers = workers
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.pending = 0
+        self.executor = None
+    
+    def start(self):
+        if self.executor is None:
+            executor_class = ProcessPoolExecutor if self.kind == 'process' else ThreadPoolExecutor
+            self.executor = executor_class(max_workers=self.workers)
+    
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+    
+    async def run(self, function, *args, in_thread=False, finished=None):
+        """Await function(*args) in the pool, or in a thread; 503 when the queue is full
+        
+        Raises asyncio.TimeoutError after the timeout. The work itself cannot
+        be stopped, so it keeps its place in the queue until it really ends,
+        and its result is still passed to finished(result) then.
+        """
+        if self.pending >= self.max_queue:
+            raise HTTPException(status_code=503, detail="Too many grammars are being compiled or parsed, try again later")
+        
+        self.start()
+        self.pending += 1
+        if in_thread:
+            future = asyncio.ensure_future(asyncio.to_thread(function, *args))
+        else:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        future.add_done_callback(lambda done: self.done(done, finished))
+        # Shielded, so a timeout does not mark the future done while the work runs on
+        return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+    
+    def done(self, future, finished):
+        self.pending -= 1
+        if not future.cancelled() and future.exception() is None and finished is not None:
+            finished(future.result())
+    
+    async def compile(self, grammar, mode, base=None, finished=None):
+        """Build a parser in the pool; 503 when the queue is full, 504 on timeout
+        
+        An edit of a cached parser (base) is recompiled in a thread instead,
+        since only the changed part is rebuilt and base would otherwise have
+        to be copied to a worker process. finished(parser) is called once the
+        build ends, even if the request timed out before.
+        """
+        try:
+            if base is not None:
+                return await self.run(compile_grammar, grammar, mode, False, base, in_thread=True, finished=finished)
+            return await self.run(compile_grammar, grammar, mode, finished=finished)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail=f"Building the parsing table took longer than {self.timeout:g}s")
+
+# Table construction runs in a process pool by default (CLR_BUILD_EXECUTOR=thread
+# keeps it in-process); parsing itself runs in the default thread pool
+build_pool = BuildPool(
+    kind=os.environ.get("CLR_BUILD_EXECUTOR", "process"),
+    workers=int(os.environ["CLR_BUILD_WORKERS"]) if "CLR_BUILD_WORKERS" in os.environ else None,
+    timeout=float(os.environ.get("CLR_REQUEST_TIMEOUT", 30)),
+    max_queue=int(os.environ.get("CLR_BUILD_QUEUE", 32))
+)
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key onto one in-flight task"""
+    def __init__(self):
+        self.in_flight = {}
+        self.coalesced = 0
+    
+    async def run(self, key, factory):
+        """Await factory() once per key; returns (result, whether an existing call was joined)
+        
+        Every caller waiting on a key gets the same result or the same
+        exception. The shared task is shielded, so one caller going away
+        does not cancel it for the others.
+        """
+        task = self.in_flight.get(key)
+        joined = task is not None
+        if joined:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(factory())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(task), joined
+
+# Concurrent requests for the same uncached grammar share one build
+build_flight = SingleFlight()
+
+class Histogram:
+    """Prometheus histogram with one series per value of a single label"""
+    def __init__(self, name, description, label, buckets):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = buckets
+        self.series = OrderedDict()   # label value -> [count per bucket..., sum, count]
+        self.lock = threading.Lock()  # observed from worker threads
+    
+    def observe(self, label_value, value):
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_value, series in self.series.items():
+                label = f'{self.label}="{label_value}"'
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound:g}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series[-1]}')
+                lines.append(f"{self.name}_sum{{{label}}} {series[-2]:g}")
+                lines.append(f"{self.name}_count{{{label}}} {series[-1]}")
+        return lines
+
+# Build phases (parse_grammar, first_follow, states, table, load) and request
+# phases (parse, result, encode, gzip), plus the sizes behind them
+phase_seconds = Histogram('clr_phase_seconds', 'Time spent in each build and request phase', 'phase',
+                          (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+table_sizes = Histogram('clr_size', 'States, items and closure calls per build, and steps per parse trace',
+                        'quantity', (10, 100, 1000, 10000, 100000, 1000000))
+
+# When set, each /parse request is profiled and its stats dumped here
+PROFILE_DIR = os.environ.get("CLR_PROFILE_DIR")
+profile_lock = threading.Lock()   # only one profiler can be active at a time
+
+def observe_build(parser: CLRParser):
+    """Record a freshly built or loaded parser's phase timings and sizes"""
+    stats = parser.get_build_stats()
+    for phase, seconds in stats['phases'].items():
+        phase_seconds.observe(phase, seconds)
+    for quantity in ('states', 'items', 'closure_calls'):
+        table_sizes.observe(quantity, stats[quantity])
+
+def server_timing(timings) -> str:
+    """Server-Timing header value for a {phase: seconds} map"""
+    return ', '.join(f"{phase};dur={seconds * 1000:.3f}" for phase, seconds in timings.items())
+
+def profiled(function, *args):
+    """Call function under cProfile and dump the stats to PROFILE_DIR; returns (result, stats path)"""
+    path = os.path.join(PROFILE_DIR, f"parse-{time.time_ns()}.prof")
+    profiler = cProfile.Profile()
+    with profile_lock:
+        result = profiler.runcall(function, *args)
+    profiler.dump_stats(path)
+    return result, path
+
+def preload_tables(directory):
+    """Put every precompiled .clrt table in a directory into the grammar cache"""
+    count = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.clrt'):
+            continue
+        parser = CLRParser.load(os.path.join(directory, name))
+        if parser.minimize_stats is not None:
+            # The cache key has no room for it, and requests expect full traces
+            print(f"Skipped {name}: minimized tables are not served")
+            continue
+        observe_build(parser)
+        grammar_cache.put((grammar_fingerprint(parser.grammar), parser.mode), parser)
+        count += 1
+    return count
+
+@asynccontextmanager
+async def lifespan(app):
+    # Tables compiled with `python -m standalone_parser compile` load in
+    # milliseconds, so warm the cache with them before serving
+    preload_dir = os.environ.get("CLR_PRELOAD_DIR")
+    if preload_dir:
+        print(f"Preloaded {preload_tables(preload_dir)} compiled tables from {preload_dir}")
+    build_pool.start()
+    yield
+    build_pool.shutdown()
+
+# Request model for batch parsing
+class BatchRequest(BaseModel):
+    grammar: List[str] = Field(..., description="List of grammar productions")
+    inputs: List[str] = Field(..., description="Input strings to be parsed against the grammar")
+    mode: Literal['clr', 'lalr'] = Field('clr', description="Table construction mode: canonical CLR(1) or LALR(1)")
+    parallel: bool = Field(False, description="Spread the inputs over the build pool's workers")
 
 app = FastAPI(
     title="CLR Parser App",
     description="A web application for parsing context-free grammars using CLR(1) parsing technique",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Enable CORS
@@ -44,8 +272,63 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Setup Jinja2 templates
 templates = Jinja2Templates(directory="templates")
 
-# Create a parser instance
-parser = CLRParser()
+class GrammarCache:
+    """Bounded LRU cache of compiled parsers keyed by grammar fingerprint and mode"""
+    def __init__(self, max_entries=64, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (parser, size in bytes)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        """Return the cached parser for a key (refreshing its recency), or None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+    
+    def peek(self, key):
+        """Return the cached parser for a key without counting a lookup, or None"""
+        entry = self.entries.get(key)
+        return entry[0] if entry is not None else None
+    
+    def put(self, key, parser):
+        """Insert a compiled parser, evicting least recently used entries to fit"""
+        size = parser.size_bytes()
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (parser, size)
+        self.total_bytes += size
+        
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+            self.evictions += 1
+    
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+# Compiled parsers, shared across requests that send the same grammar
+grammar_cache = GrammarCache(
+    max_entries=int(os.environ.get("CLR_CACHE_ENTRIES", 64)),
+    max_bytes=int(os.environ.get("CLR_CACHE_BYTES", 256 * 1024 * 1024))
+)
 
 @app.get("/", response_class=HTMLResponse)
 async def get_home(request: Request):
@@ -60,54 +343,376 @@ async def api_info():
         "version": "1.0.0",
         "endpoints": {
             "/parse": "Parse a string using the CLR parsing algorithm",
+            "/parse/batch": "Parse many strings against one grammar, streaming NDJSON results",
+            "/parse/batch/upload": "Like /parse/batch, with the inputs uploaded one per line",
+            "/parse/stream": "Validate a chunked upload incrementally, failing fast on the first error",
+            "/cache": "Grammar cache statistics",
+            "/metrics": "Phase timing histograms and cache counters in Prometheus format",
             "/docs": "API documentation"
         }
     }
 
-def convert_sets_to_lists(obj: Any) -> Any:
-    """Convert sets to lists recursively in a dictionary or list"""
-    if isinstance(obj, dict):
-        return {k: convert_sets_to_lists(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_sets_to_lists(item) for item in obj]
-    elif isinstance(obj, set):
-        return [convert_sets_to_lists(item) for item in obj]
-    else:
-        return obj
+@app.get("/cache")
+async def cache_stats():
+    """Hit/miss counts and size of the compiled grammar cache"""
+    return {
+        **grammar_cache.stats(),
+        'builds_in_flight': len(build_flight.in_flight),
+        'coalesced': build_flight.coalesced
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Phase timings, table sizes and cache counters in the Prometheus text format"""
+    cache = grammar_cache.stats()
+    lines = phase_seconds.render() + table_sizes.render()
+    for name, kind, value in (('clr_cache_hits_total', 'counter', cache['hits']),
+                              ('clr_cache_misses_total', 'counter', cache['misses']),
+                              ('clr_cache_evictions_total', 'counter', cache['evictions']),
+                              ('clr_cache_entries', 'gauge', cache['entries']),
+                              ('clr_cache_bytes', 'gauge', cache['bytes']),
+                              ('clr_builds_in_flight', 'gauge', len(build_flight.in_flight)),
+                              ('clr_builds_coalesced_total', 'counter', build_flight.coalesced)):
+        lines += [f"# TYPE {name} {kind}", f"{name} {value}"]
+    return PlainTextResponse('\n'.join(lines) + '\n', media_type='text/plain; version=0.0.4')
+
+def encode_json(content) -> bytes:
+    """Encode a response body, with orjson if it is installed; sets are encoded as lists"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(content, default=list)
+        except TypeError:
+            pass   # e.g. an integer beyond 64 bits, such as a huge GLR parse count
+    return json.dumps(content, default=list, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def grammar_etag(grammar: List[str], mode: str, table_format: str) -> str:
+    """ETag of the grammar fields of a /parse response"""
+    return f'"{grammar_fingerprint(grammar)}-{mode}-{table_format}"'
+
+def etag_cache_key(etag: Optional[str]):
+    """The grammar cache key of the grammar a grammar_etag was made for, or None"""
+    parts = (etag or '').strip('"').split('-')
+    return (parts[0], parts[1]) if len(parts) == 3 else None
+
+async def build_parser(key, grammar: List[str], mode: str, base: Optional[CLRParser] = None) -> CLRParser:
+    """Compile a grammar in the build pool, or as an edit of base, and cache the result"""
+    def finished(parser):
+        # A build that outlived its request is still cached for the next one
+        observe_build(parser)
+        grammar_cache.put(key, parser)
+    
+    return await build_pool.compile(grammar, mode, base, finished)
+
+async def get_parser(grammar: List[str], mode: str, base_key=None):
+    """The compiled parser for a grammar and how it was obtained ('hit', 'miss', 'edit' or 'shared')
+    
+    On a miss, a cached parser under base_key (the grammar the client
+    compiled before) is recompiled rather than building from scratch.
+    """
+    # Reuse the compiled tables if this grammar was seen recently
+    key = (grammar_fingerprint(grammar), mode)
+    parser = grammar_cache.get(key)
+    if parser is not None:
+        return parser, 'hit'
+    
+    base = grammar_cache.peek(base_key) if base_key is not None else None
+    parser, joined = await build_flight.run(key, lambda: build_parser(key, grammar, mode, base))
+    return parser, 'shared' if joined else 'edit' if base is not None else 'miss'
+
+def run_parse(parser: CLRParser, request: ParserRequest, fields):
+    """Parse the request's input and build the response, with the time of each phase
+    
+    Only the given result fields are built, and the trace is only recorded
+    if parsing_steps is one of them. Returns (result, timings, ParseResult).
+    """
+    timings = OrderedDict()
+    started = time.perf_counter()
+    
+    # Parse the input string
+    trace = 'parsing_steps' in fields
+    parse_result = parser.parse(request.input_string, trace=trace, max_steps=request.max_steps,
+                                tree=request.build_tree)
+    started = record_phase(timings, 'parse', started)
+    
+    # Get the result; sets are left for encode_json to write as lists
+    result = parser.get_result(parse_result, fields, request.table_format)
+    if request.compare_modes:
+        result['mode_comparison'] = parser.compare_modes()
+    if request.glr:
+        glr_result = parser.parse_glr(request.input_string)
+        result['glr'] = {
+            'is_accepted': glr_result.accepted,
+            'error_position': glr_result.error_position,
+            'steps': glr_result.step_count,
+            **glr_result.stats
+        }
+    if request.build_tree:
+        result['parse_tree'] = parse_result.tree.to_dict() if parse_result.tree is not None else None
+    record_phase(timings, 'result', started)
+    
+    if trace:
+        table_sizes.observe('trace_steps', len(parse_result.steps))
+    return result, timings, parse_result
+
+def record_phase(timings, phase, started):
+    """Store the time since `started` under a phase and return the current time"""
+    now = time.perf_counter()
+    timings[phase] = now - started
+    return now
+
+# Responses at least this large are gzipped for clients that accept it
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 5
 
 @app.post("/parse")
-async def parse_input(request: ParserRequest):
+async def parse_input(request: ParserRequest, http_request: Request):
     """
     Parse input string using CLR(1) parsing algorithm.
     
     This endpoint accepts:
     - Grammar productions (e.g. S->CC, C->cC, C->d)
     - Input string to be parsed
+    - Table construction mode ('clr' or 'lalr')
     
     It returns:
     - First and Follow sets for non-terminals
-    - Parsing table
+    - Parsing table and its state count
     - Parsing steps
     - Whether the input is accepted by the grammar
+    - The parse tree, if build_tree is set
+    - GLR parse and GSS counts, if glr is set
+    - Per-phase timings and table sizes, if timings is set
+    
+    The fields option selects which result fields are returned, and
+    table_format='compact' returns the table as integer rows.
+    
+    Every response has a Server-Timing header with the same phases, and an
+    ETag for the grammar fields: sending it back in If-None-Match leaves
+    those fields out. Large responses are gzipped if the client accepts it.
     """
     try:
-        # Initialize the parser with the grammar
-        parser.initialize_parser(request.grammar)
+        # The grammar fields the client holds are those of its last grammar,
+        # which is the base to recompile from if this one is an edit of it
+        parser, cache_status = await get_parser(request.grammar, request.mode,
+                                                etag_cache_key(http_request.headers.get('if-none-match')))
         
-        # Parse the input string
-        parser.parse_input(request.input_string)
+        # A client that already holds the grammar fields for this ETag only
+        # gets the input fields back
+        etag = grammar_etag(request.grammar, request.mode, request.table_format)
+        headers = {'X-Grammar-Cache': cache_status, 'ETag': etag, 'Vary': 'Accept-Encoding'}
+        fields = list(request.fields) if request.fields is not None else list(RESULT_FIELDS)
+        if http_request.headers.get('if-none-match') == etag:
+            fields = [field for field in fields if field not in GRAMMAR_RESULT_FIELDS]
+            headers['X-Grammar-Fields'] = 'not-modified'
         
-        # Get the result
-        result = parser.get_result()
+        # Parse in a worker thread; the parse state lives in the result, so
+        # concurrent requests can share the cached parser
+        try:
+            if PROFILE_DIR:
+                (serializable_result, timings, parse_result), headers['X-Profile'] = await build_pool.run(
+                    profiled, run_parse, parser, request, fields, in_thread=True)
+            else:
+                serializable_result, timings, parse_result = await build_pool.run(
+                    run_parse, parser, request, fields, in_thread=True)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail=f"Parsing took longer than {build_pool.timeout:g}s")
         
-        # Convert sets to lists for JSON serialization
-        serializable_result = convert_sets_to_lists(result)
+        # Build phases only count against the request that ran the build
+        if cache_status in ('miss', 'edit'):
+            timings = OrderedDict(list(parser.build_timings.items()) + list(timings.items()))
+        if request.timings:
+            serializable_result['timings'] = {
+                'cache': cache_status,
+                'phases_ms': {phase: round(seconds * 1000, 3) for phase, seconds in timings.items()},
+                **{key: value for key, value in parser.get_build_stats().items() if key != 'phases'},
+                'trace_steps': len(parse_result.steps)
+            }
         
-        return JSONResponse(content=serializable_result)
+        started = time.perf_counter()
+        body = encode_json(serializable_result)
+        started = record_phase(timings, 'encode', started)
+        if len(body) >= GZIP_MIN_SIZE and 'gzip' in http_request.headers.get('accept-encoding', ''):
+            body = gzip.compress(body, GZIP_LEVEL)
+            headers['Content-Encoding'] = 'gzip'
+            record_phase(timings, 'gzip', started)
         
+        for phase in ('parse', 'result', 'encode', 'gzip'):
+            if phase in timings:
+                phase_seconds.observe(phase, timings[phase])
+        headers['Server-Timing'] = server_timing(timings)
+        return Response(content=body, media_type='application/json', headers=headers)
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Inputs are parsed and streamed back in chunks of this many
+BATCH_CHUNK = 256
+
+# Parsers loaded inside batch worker processes, by table file; a lock
+# keeps the cache consistent if the workers are threads
+worker_parsers = OrderedDict()
+worker_parsers_lock = threading.Lock()
+
+# Tables saved for batch worker processes to load, by grammar key
+BATCH_TABLE_DIR = tempfile.mkdtemp(prefix='clr-batch-')
+batch_tables = OrderedDict()
+batch_tables_lock = threading.Lock()
+
+def batch_lines(parser: CLRParser, inputs: List[str], start: int) -> str:
+    """One compact NDJSON result line per input"""
+    lines = []
+    for index, input_string in enumerate(inputs, start):
+        result = parser.parse(input_string)
+        lines.append(json.dumps({'index': index, 'accepted': result.accepted, 'steps': result.step_count,
+                                 'error_position': result.error_position}, separators=(',', ':')))
+    return '\n'.join(lines) + '\n'
+
+def worker_batch_lines(path: str, inputs: List[str], start: int) -> str:
+    """batch_lines in a worker process, loading each saved table once per process"""
+    with worker_parsers_lock:
+        parser = worker_parsers.get(path)
+        if parser is None:
+            parser = worker_parsers[path] = CLRParser.load(path)
+            if len(worker_parsers) > 8:
+                worker_parsers.popitem(last=False)
+    return batch_lines(parser, inputs, start)
+
+def save_batch_table(key, parser: CLRParser) -> str:
+    """Save a cached parser's table for batch worker processes, once per grammar; returns its path"""
+    with batch_tables_lock:
+        path = batch_tables.get(key)
+        if path is None:
+            path = os.path.join(BATCH_TABLE_DIR, f"{key[0]}-{key[1]}.clrt")
+            parser.save(path + '.tmp')
+            os.replace(path + '.tmp', path)
+            batch_tables[key] = path
+            if len(batch_tables) > 32:
+                # Workers that still map an evicted file keep their pages
+                os.remove(batch_tables.popitem(last=False)[1])
+        return path
+
+async def stream_batch(parser: CLRParser, grammar: List[str], mode: str, inputs: List[str], parallel: bool):
+    """Yield NDJSON result lines chunk by chunk, in input order
+    
+    Every chunk goes through the build pool, so it counts against the queue
+    bound and the timeout. In parallel, thread workers share the cached
+    parser and process workers load its saved table. If a chunk is refused
+    or times out, an error line ends the stream.
+    """
+    window = 2 * (build_pool.workers or os.cpu_count() or 1) if parallel else 1
+    pending = deque()
+    
+    try:
+        path = None
+        if parallel and build_pool.kind == 'process':
+            path = await build_pool.run(save_batch_table, (grammar_fingerprint(grammar), mode), parser, in_thread=True)
+        
+        for start in range(0, len(inputs), BATCH_CHUNK):
+            chunk = inputs[start:start + BATCH_CHUNK]
+            if path is not None:
+                work = build_pool.run(worker_batch_lines, path, chunk, start)
+            else:
+                work = build_pool.run(batch_lines, parser, chunk, start, in_thread=not parallel)
+            pending.append(asyncio.ensure_future(work))
+            
+            # Keep a bounded number of chunks in flight
+            if len(pending) >= window:
+                yield await pending.popleft()
+        
+        while pending:
+            yield await pending.popleft()
+    
+    except (HTTPException, asyncio.TimeoutError) as e:
+        detail = e.detail if isinstance(e, HTTPException) else f"A chunk took longer than {build_pool.timeout:g}s"
+        yield json.dumps({'error': detail}) + '\n'
+    finally:
+        # Work already running keeps its queue slot until it ends
+        for task in pending:
+            if task.done() and not task.cancelled():
+                task.exception()
+            task.cancel()
+
+@app.post("/parse/batch")
+async def parse_batch(request: BatchRequest):
+    """
+    Parse many input strings against one grammar.
+    
+    The grammar is compiled (or taken from the cache) once, and one line of
+    JSON is streamed back per input, in order:
+    {"index": 0, "accepted": true, "steps": 12, "error_position": null}
+    """
+    try:
+        parser, cache_status = await get_parser(request.grammar, request.mode)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return StreamingResponse(stream_batch(parser, request.grammar, request.mode, request.inputs, request.parallel),
+                             media_type="application/x-ndjson", headers={'X-Grammar-Cache': cache_status})
+
+@app.post("/parse/batch/upload")
+async def parse_batch_upload(request: Request, grammar: List[str] = Query(...),
+                             mode: Literal['clr', 'lalr'] = 'clr', parallel: bool = False):
+    """
+    Parse an uploaded file of input strings, one per line, against one grammar.
+    
+    The grammar is given as repeated `grammar` query parameters and the
+    request body is the plain-text input file. Results are streamed as
+    for /parse/batch.
+    """
+    try:
+        parser, cache_status = await get_parser(grammar, mode)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    body = (await request.body()).decode('utf-8')
+    inputs = body.splitlines()
+    
+    return StreamingResponse(stream_batch(parser, grammar, mode, inputs, parallel),
+                             media_type="application/x-ndjson", headers={'X-Grammar-Cache': cache_status})
+
+@app.post("/parse/stream")
+async def parse_stream(request: Request, grammar: List[str] = Query(...), mode: Literal['clr', 'lalr'] = 'clr'):
+    """
+    Validate a (possibly chunked) request body against a grammar as it arrives.
+    
+    The grammar is given as repeated `grammar` query parameters and the
+    request body is the input string itself, with no separators. Each
+    chunk is fed to an incremental parser, so memory stays constant, and
+    the response is sent as soon as an error is found without reading the
+    rest of the body.
+    """
+    try:
+        parser, cache_status = await get_parser(grammar, mode)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    push = parser.incremental()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    result = None
+    
+    async for chunk in request.stream():
+        result = await asyncio.to_thread(push.feed, decoder.decode(chunk))
+        if result is not None:
+            break
+    else:
+        push.feed(decoder.decode(b'', final=True))
+        result = push.finish()
+    
+    return JSONResponse(content={
+        'is_accepted': result.accepted,
+        'steps': result.step_count,
+        'error_position': result.error_position,
+        'consumed': push.position
+    }, headers={'X-Grammar-Cache': cache_status})
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
     uvicorn.run("server:app", host="0.0.0.0", port=port, reload=True) 
\ No newline at end of file
@@ -1,6 +1,22 @@
 from collections import OrderedDict
-from typing import List, Dict, Tuple, Set, Any, Optional
+from typing import List, Dict, Tuple, Set, Any, Optional, NamedTuple
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import hashlib
+import itertools
 import json
+import mmap
+import re
+import struct
+import sys
+import threading
+import time
+
+try:
+    from re import _parser as sre_parse   # Python 3.11+
+except ImportError:
+    import sre_parse
 
 class Terminal:
     def __init__(self, symbol):
@@ -18,43 +34,1346 @@ class NonTerminal:
     def add_follow(self, symbols): 
         self.follow |= set(symbols)
 
-class Item(str):
-    def __new__(cls, item, lookahead=None):
-        self = str.__new__(cls, item)
-        self.lookahead = lookahead or []
-        return self
+def normalize_grammar(grammar):
+    """The productions parse_grammar actually uses, in order"""
+    return [production for production in grammar if production and production.lower() != 'end']
+
+def grammar_fingerprint(grammar):
+    """A stable hash of the normalized production list"""
+    return hashlib.sha256('\n'.join(normalize_grammar(grammar)).encode('utf-8')).hexdigest()
+
+def iter_bits(mask):
+    """Yield the indices of the set bits of an integer bitmask, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
 
-    def __str__(self):
-        return super(Item, self).__str__() + ", " + '|'.join(self.lookahead)
+class Item(NamedTuple):
+    """An LR(1) item: production index, dot position and lookahead bitmask"""
+    prod: int
+    dot: int
+    lookahead: int
 
 class State:
-    _id = 0
-    def __init__(self, closure):
-        self.closure = closure
-        self.no = State._id
-        State._id += 1
+    """A CLR(1) state: a frozen, hashable kernel, its closure and its transitions"""
+    __slots__ = ('no', 'kernel', 'closure', 'transitions')
+
+    def __init__(self, no, kernel, closure):
+        self.no = no
+        self.kernel = kernel      # sorted tuple of Items
+        self.closure = closure    # {(prod, dot): lookahead bitmask}
+        self.transitions = {}     # {symbol id: target state no}
+
+# Integer action encoding used by the compiled tables: 0 is an error entry,
+# shift to state s is s + 1 and reduce by production p is -(p + 1), so that
+# accepting (reducing by the augmented production 0) is -1
+ERROR = 0
+ACCEPT = -1
+
+def encode_shift(state):
+    return state + 1
+
+def encode_reduce(prod):
+    return -(prod + 1)
+
+def row_default(row):
+    """The most common action of an ACTION row with no error entries, else ERROR
+    
+    Such a row (one with a default reduction, say) can store that action
+    once and only list the columns that differ from it.
+    """
+    if ERROR in row or not row:
+        return ERROR
+    return max(sorted(set(row)), key=row.count)
+
+# On-disk compiled table (.clrt): magic, format version and metadata length,
+# the JSON metadata, then the table's int32 arrays, little-endian and 8-byte
+# aligned, at the offsets listed in the metadata
+TABLE_MAGIC = b'CLRT'
+TABLE_FORMAT_VERSION = 3
+TABLE_HEADER = struct.Struct('<4sII')
+
+# Keys of CLRParser.get_result(); the grammar fields only depend on the
+# grammar and mode, so clients can reuse them across inputs
+GRAMMAR_RESULT_FIELDS = ('non_terminals', 'terminals', 'first_follow', 'parse_table', 'conflicts', 'mode',
+                         'state_count')
+INPUT_RESULT_FIELDS = ('parsing_steps', 'trace_truncated', 'is_accepted')
+RESULT_FIELDS = GRAMMAR_RESULT_FIELDS + INPUT_RESULT_FIELDS
+
+# A trace step shows at most this many characters of the remaining input
+# and this many entries from the top of the stack, with '…' for the rest,
+# so each step has a bounded size however long the input is
+TRACE_WINDOW = 64
+
+# A parallel build expands frontiers smaller than this in the coordinator,
+# where a round trip to the pool would cost more than the states themselves
+PARALLEL_MIN_FRONTIER = 16
+
+class ParseTable:
+    """Compiled parse table: dense integer ACTION/GOTO matrices indexed by state and column"""
+    # Integer arrays that make up the table, as stored in .clrt files
+    ARRAYS = ('prod_heads', 'prod_lengths', 'action', 'goto')
+    
+    def __init__(self, terminals, nonterminals, n_states, prod_heads, prod_lengths):
+        self.terminals = terminals          # column order of ACTION
+        self.nonterminals = nonterminals    # column order of GOTO
+        self.n_states = n_states
+        self.prod_heads = array('i', prod_heads)      # GOTO column of each head
+        self.prod_lengths = array('i', prod_lengths)
+        self.action = array('i', [ERROR]) * (n_states * len(terminals))
+        self.goto = array('i', [-1]) * (n_states * len(nonterminals))
+        self.conflicts = {}   # {(state, column): set of encoded actions}
+    
+    @classmethod
+    def from_arrays(cls, terminals, nonterminals, n_states, arrays, conflicts):
+        """Rebuild a table around existing arrays (or memoryviews) without copying them"""
+        table = cls.__new__(cls)
+        table.terminals = terminals
+        table.nonterminals = nonterminals
+        table.n_states = n_states
+        for name in cls.ARRAYS:
+            setattr(table, name, arrays[name])
+        table.conflicts = conflicts
+        return table
+    
+    def add_action(self, state, column, action):
+        """Add an action, resolving conflicts yacc-style (shift, else lowest production)"""
+        index = state * len(self.terminals) + column
+        current = self.action[index]
+        if current == ERROR:
+            self.action[index] = action
+        elif current != ACCEPT and current != action:
+            candidates = self.conflicts.setdefault((state, column), {current})
+            candidates.add(action)
+            self.action[index] = max(candidates)
+    
+    def set_accept(self, state, column):
+        self.action[state * len(self.terminals) + column] = ACCEPT
+        self.conflicts.pop((state, column), None)
+    
+    def set_goto(self, state, column, target):
+        self.goto[state * len(self.nonterminals) + column] = target
+    
+    def action_at(self, state, column):
+        return self.action[state * len(self.terminals) + column]
+    
+    def goto_at(self, state, column):
+        return self.goto[state * len(self.nonterminals) + column]
+    
+    def actions_at(self, state, column):
+        """Every action of a cell, including the ones conflict resolution dropped"""
+        candidates = self.conflicts.get((state, column))
+        return candidates if candidates is not None else (self.action_at(state, column),)
+    
+    def size_bytes(self):
+        return (len(self.action) * self.action.itemsize + len(self.goto) * self.goto.itemsize)
+    
+    def compress(self):
+        """Pack the ACTION and GOTO matrices with row displacement"""
+        return CompressedParseTable(self)
+    
+    def count_conflicts(self):
+        """Count shift/reduce and reduce/reduce conflicts"""
+        sr, rr = 0, 0
+        for actions in self.conflicts.values():
+            s_count = sum(1 for a in actions if a > 0)
+            r_count = len(actions) - s_count
+            if r_count > 0 and s_count > 0:
+                sr += 1
+            elif r_count > 1:
+                rr += 1
+        return {'s/r': sr, 'r/r': rr}
+    
+    def entry_counts(self):
+        """States, stored ACTION and GOTO entries, and bytes; a row's default action counts once"""
+        action_entries = goto_entries = 0
+        for state in range(self.n_states):
+            row = self.action_row(state)
+            default = row_default(row)
+            action_entries += sum(1 for action in row if action != default) + (default != ERROR)
+            goto_entries += sum(1 for target in self.goto_row(state) if target >= 0)
+        return OrderedDict([('states', self.n_states), ('action_entries', action_entries),
+                            ('goto_entries', goto_entries), ('bytes', self.size_bytes())])
+    
+    def minimize(self, units=()):
+        """An equivalent dense table with default reductions and merged rows
+        
+        units are unit productions A -> B whose reductions may be bypassed:
+        a goto on B that leads to a state which can only reduce by A -> B
+        is sent straight to the goto on A, provided the state reduces on
+        every column that goto target has an action for. A state without
+        conflicts whose only reductions are by one production then reduces
+        by it on every column it has no action for; this only delays error
+        detection to a later reduction, never past a shift. Finally states
+        that act alike on every column, with targets that act alike, are
+        merged and unreachable states dropped. The same inputs are accepted
+        and rejected at the same position. Returns the table and the
+        numbers of bypassed gotos and default reductions.
+        """
+        n_states, n_terminals = self.n_states, len(self.terminals)
+        actions = [self.action_row(state) for state in range(n_states)]
+        gotos = [self.goto_row(state) for state in range(n_states)]
+        conflicted = {state for state, column in self.conflicts}
+        units = set(units)
+        
+        # Follow each goto through the unit reductions it can skip
+        bypassed = 0
+        for state in range(n_states):
+            for column, target in enumerate(gotos[state]):
+                seen = set()
+                while target >= 0 and target not in seen and target not in conflicted:
+                    seen.add(target)
+                    row = actions[target]
+                    reductions = set(row) - {ERROR}
+                    if len(reductions) != 1 or any(after >= 0 for after in gotos[target]):
+                        break
+                    prod = -reductions.pop() - 1
+                    after = gotos[state][self.prod_heads[prod]] if prod in units else -1
+                    if after < 0 or any(action != ERROR and row[c] == ERROR for c, action in enumerate(actions[after])):
+                        break
+                    target = after
+                if target != gotos[state][column]:
+                    gotos[state][column] = target
+                    bypassed += 1
+        
+        # Default reductions
+        defaults = 0
+        for state, row in enumerate(actions):
+            reductions = {action for action in row if action < ACCEPT}
+            if len(reductions) == 1 and ERROR in row and state not in conflicted:
+                default = reductions.pop()
+                actions[state] = [default if action == ERROR else action for action in row]
+                defaults += 1
+        
+        # States reachable from the start state, in breadth-first order
+        reachable, seen = [0], {0}
+        for state in reachable:
+            for target in itertools.chain((action - 1 for action in actions[state] if action > 0), gotos[state]):
+                if target >= 0 and target not in seen:
+                    seen.add(target)
+                    reachable.append(target)
+        
+        row_conflicts = {}
+        for (state, column), candidates in self.conflicts.items():
+            row_conflicts.setdefault(state, []).append((column, candidates))
+        
+        # Split classes of states until every member of a class has the same
+        # row, up to the classes of its targets; classes are numbered in
+        # reachable order, so the start state stays 0
+        classes = dict.fromkeys(reachable, 0)
+        n_classes = 1
+        
+        def shift(action):
+            return encode_shift(classes[action - 1]) if action > 0 else action
+        
+        while True:
+            signatures = {}
+            refined = {}
+            for state in reachable:
+                signature = (classes[state], tuple(map(shift, actions[state])),
+                             tuple(classes[target] if target >= 0 else -1 for target in gotos[state]),
+                             tuple(sorted((column, tuple(sorted(map(shift, candidates))))
+                                          for column, candidates in row_conflicts.get(state, ()))))
+                refined[state] = signatures.setdefault(signature, len(signatures))
+            classes = refined
+            if len(signatures) == n_classes:
+                break
+            n_classes = len(signatures)
+        
+        table = ParseTable(self.terminals, self.nonterminals, n_classes, self.prod_heads, self.prod_lengths)
+        n_nonterminals = len(self.nonterminals)
+        done = set()
+        for state in reachable:
+            no = classes[state]
+            if no in done:
+                continue
+            done.add(no)
+            table.action[no * n_terminals:(no + 1) * n_terminals] = array('i', map(shift, actions[state]))
+            table.goto[no * n_nonterminals:(no + 1) * n_nonterminals] = array(
+                'i', [classes[target] if target >= 0 else -1 for target in gotos[state]])
+            for column, candidates in row_conflicts.get(state, ()):
+                table.conflicts[(no, column)] = set(map(shift, candidates))
+        
+        return table, bypassed, defaults
+    
+    def action_row(self, state):
+        width = len(self.terminals)
+        return self.action[state * width:(state + 1) * width].tolist()
+    
+    def goto_row(self, state):
+        width = len(self.nonterminals)
+        return self.goto[state * width:(state + 1) * width].tolist()
+    
+    def to_compact(self):
+        """Symbol header plus one list of encoded actions (and of gotos) per state"""
+        return {
+            'terminals': list(self.terminals),
+            'nonterminals': list(self.nonterminals),
+            'action': [self.action_row(state) for state in range(self.n_states)],
+            'goto': [self.goto_row(state) for state in range(self.n_states)],
+            'conflicts': [[state, column, sorted(actions)] for (state, column), actions in sorted(self.conflicts.items())]
+        }
+    
+    def to_dict(self):
+        """Expand into the {state: {symbol: action}} view with 's5'/'r3' strings"""
+        def action_str(action):
+            return 's' + str(action - 1) if action > 0 else 'r' + str(-action - 1)
+        
+        parsing_table = OrderedDict()
+        for state in range(self.n_states):
+            row = parsing_table[state] = OrderedDict()
+            for column, symbol in enumerate(self.terminals):
+                action = self.action_at(state, column)
+                if action == ACCEPT:
+                    row[symbol] = 'accept'
+                elif (state, column) in self.conflicts:
+                    row[symbol] = {action_str(a) for a in self.conflicts[(state, column)]}
+                elif action != ERROR:
+                    row[symbol] = {action_str(action)}
+            for column, symbol in enumerate(self.nonterminals):
+                target = self.goto_at(state, column)
+                if target >= 0:
+                    row[symbol] = str(target)
+        return parsing_table
+
+def displace_rows(rows, empty):
+    """Pack sparse rows of (column, value) pairs into one comb vector
+
+    Returns (base, check, value) arrays such that row r, column c holds
+    value[base[r] + c] when check[base[r] + c] == r, and `empty` otherwise.
+    """
+    base = array('i', [0]) * len(rows)
+    check = array('i')
+    value = array('i')
+    first_free = 0
+    
+    # Dense rows first: they are the hardest to fit
+    for r in sorted(range(len(rows)), key=lambda r: -len(rows[r])):
+        entries = rows[r]
+        if not entries:
+            continue
+        
+        b = first_free - entries[0][0]
+        while True:
+            if b >= 0 and all(b + c >= len(check) or check[b + c] < 0 for c, _ in entries):
+                break
+            b += 1
+        
+        end = b + entries[-1][0] + 1
+        if end > len(check):
+            check.extend([-1] * (end - len(check)))
+            value.extend([empty] * (end - len(value)))
+        for c, v in entries:
+            check[b + c] = r
+            value[b + c] = v
+        base[r] = b
+        
+        while first_free < len(check) and check[first_free] >= 0:
+            first_free += 1
+    
+    return base, check, value
+
+class CompressedParseTable(ParseTable):
+    """Parse table whose ACTION and GOTO rows are packed with row displacement"""
+    ARRAYS = ('prod_heads', 'prod_lengths', 'action_base', 'action_check', 'action_value', 'action_default',
+              'goto_base', 'goto_check', 'goto_value')
+    
+    def __init__(self, table):
+        self.terminals = table.terminals
+        self.nonterminals = table.nonterminals
+        self.n_states = table.n_states
+        self.prod_heads = table.prod_heads
+        self.prod_lengths = table.prod_lengths
+        self.conflicts = table.conflicts
+        
+        # A row without error entries stores its most common action once, as
+        # the default for the columns the row does not list
+        action_rows = []
+        self.action_default = array('i')
+        for s in range(self.n_states):
+            row = table.action_row(s)
+            default = row_default(row)
+            self.action_default.append(default)
+            action_rows.append([(c, action) for c, action in enumerate(row) if action != ERROR and action != default])
+        goto_rows = [[(c, target) for c, target in enumerate(table.goto_row(s)) if target >= 0]
+                     for s in range(self.n_states)]
+        self.action_base, self.action_check, self.action_value = displace_rows(action_rows, ERROR)
+        self.goto_base, self.goto_check, self.goto_value = displace_rows(goto_rows, -1)
+    
+    def action_at(self, state, column):
+        index = self.action_base[state] + column
+        if index < len(self.action_check) and self.action_check[index] == state:
+            return self.action_value[index]
+        return self.action_default[state]
+    
+    def goto_at(self, state, column):
+        index = self.goto_base[state] + column
+        if index < len(self.goto_check) and self.goto_check[index] == state:
+            return self.goto_value[index]
+        return -1
+    
+    def action_row(self, state):
+        return [self.action_at(state, column) for column in range(len(self.terminals))]
+    
+    def goto_row(self, state):
+        return [self.goto_at(state, column) for column in range(len(self.nonterminals))]
+    
+    def size_bytes(self):
+        return sum(len(getattr(self, name)) * getattr(self, name).itemsize for name in self.ARRAYS[2:])
+    
+    def compress(self):
+        return self
+
+class LazyParseTable(ParseTable):
+    """CLR(1) parse table whose states are built the first time the driver reaches them
+    
+    A state starts out as its kernel; its closure, transitions and row are
+    made on the first lookup, so a parse only pays for the states it visits.
+    States are numbered in the order they are found. finish() builds the
+    rest and returns the collection numbered as calc_states numbers it.
+    """
+    def __init__(self, parser):
+        n_terminals = parser.n_terminals
+        super().__init__(parser.symbols[:n_terminals], parser.symbols[n_terminals:], 0,
+                         [head - n_terminals for head in parser.prod_heads],
+                         [len(body) for body in parser.prod_bodies])
+        self.parser = parser
+        self.states = []
+        self.state_index = {}
+        self.expanded = bytearray()
+        self.lock = threading.Lock()   # parsers are shared between request threads
+        self.add_state((Item(0, 0, 1 << parser.end_marker),))
+    
+    def add_state(self, kernel):
+        no = len(self.states)
+        self.states.append(State(no, kernel, None))
+        self.state_index[kernel] = no
+        self.action.extend(array('i', [ERROR]) * len(self.terminals))
+        self.goto.extend(array('i', [-1]) * len(self.nonterminals))
+        self.expanded.append(0)
+        self.n_states += 1
+        return no
+    
+    def expand(self, no):
+        """Build a state's closure, transitions and row of the table"""
+        with self.lock:
+            if self.expanded[no]:
+                return
+            parser = self.parser
+            s = self.states[no]
+            s.closure = parser.closure(s.kernel)
+            for symbol, kernel in parser.successors(s.closure):
+                target = self.state_index.get(kernel)
+                if target is None:
+                    target = self.add_state(kernel)
+                s.transitions[symbol] = target
+            parser.add_row(self, s)
+            self.expanded[no] = 1
+    
+    def action_at(self, state, column):
+        if not self.expanded[state]:
+            self.expand(state)
+        return self.action[state * len(self.terminals) + column]
+    
+    def goto_at(self, state, column):
+        if not self.expanded[state]:
+            self.expand(state)
+        return self.goto[state * len(self.nonterminals) + column]
+    
+    def actions_at(self, state, column):
+        if not self.expanded[state]:
+            self.expand(state)
+        return super().actions_at(state, column)
+    
+    def compress(self):
+        raise ValueError("A lazy table has to be finished before it can be compressed")
+    
+    def finish(self):
+        """Expand every remaining state and return the full collection in calc_states numbering"""
+        no = 0
+        while no < len(self.states):   # expanding may append more states
+            if not self.expanded[no]:
+                self.expand(no)
+            no += 1
+        
+        # calc_states numbers states breadth-first, taking successors in
+        # symbol order, which is the order transitions were recorded in
+        order, number = [0], {0: 0}
+        for old in order:
+            for target in self.states[old].transitions.values():
+                if target not in number:
+                    number[target] = len(order)
+                    order.append(target)
+        
+        states = []
+        for old in order:
+            s = self.states[old]
+            state = State(number[old], s.kernel, s.closure)
+            state.transitions = {symbol: number[target] for symbol, target in s.transitions.items()}
+            states.append(state)
+        return states
+
+class ParseResult:
+    """The outcome of parsing one input, kept apart from the compiled tables"""
+    __slots__ = ('accepted', 'steps', 'truncated', 'error_position', 'step_count', 'tree', 'forest', 'stats')
+
+    def __init__(self, accepted, steps=None, truncated=False, error_position=None, step_count=0, tree=None,
+                 stats=None):
+        self.accepted = accepted
+        self.steps = steps if steps is not None else []
+        self.truncated = truncated
+        self.error_position = error_position   # index of the rejected symbol
+        self.step_count = step_count           # shift and reduce actions taken
+        self.tree = tree                       # ParseTree, when one was requested
+        self.forest = None                     # ParseForest, from the GLR driver
+        self.stats = stats                     # performance counters, from the GLR driver
+
+class ParseTree:
+    """A parse tree stored as flat parallel arrays, one entry per node
+    
+    Nodes are numbered in the order they are completed, so children come
+    before their parent and the root is the last node. For node i, rules[i]
+    is the production it was reduced by, or -(column + 1) for a token;
+    children[first_child[i]:first_child[i] + child_count[i]] are its child
+    nodes; and starts[i]:ends[i] is the span of input it covers.
+    """
+    def __init__(self, parser, source):
+        self.symbols = parser.symbols
+        self.productions = parser.production_list
+        self.prod_heads = parser.prod_heads
+        self.source = source
+        self.rules = array('i')
+        self.first_child = array('i')
+        self.child_count = array('i')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.children = array('i')
+    
+    def __len__(self):
+        return len(self.rules)
+    
+    @property
+    def root(self):
+        return ParseNode(self, len(self.rules) - 1) if self.rules else None
+    
+    def node(self, index):
+        return ParseNode(self, index)
+    
+    def symbol_of(self, index):
+        """Symbol id of a node: the token's terminal or the head of its production"""
+        rule = self.rules[index]
+        return -rule - 1 if rule < 0 else self.prod_heads[rule]
+    
+    def size_bytes(self):
+        arrays = (self.rules, self.first_child, self.child_count, self.starts, self.ends, self.children)
+        return sum(len(a) * a.itemsize for a in arrays)
+    
+    def to_dict(self):
+        """JSON-ready export that keeps the flat layout, so deep trees need no recursion to encode"""
+        symbol_of = self.symbol_of
+        return {
+            'symbols': self.symbols,
+            'productions': self.productions,
+            'root': len(self.rules) - 1,
+            'symbol': [symbol_of(i) for i in range(len(self.rules))],
+            'rule': [max(rule, -1) for rule in self.rules],
+            'start': self.starts.tolist(),
+            'end': self.ends.tolist(),
+            'first_child': self.first_child.tolist(),
+            'child_count': self.child_count.tolist(),
+            'children': self.children.tolist()
+        }
+
+class ParseNode:
+    """Lazy view of one node of a ParseTree, made on access from the tree and an index"""
+    __slots__ = ('tree', 'index')
+    
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+    
+    @property
+    def is_token(self):
+        return self.tree.rules[self.index] < 0
+    
+    @property
+    def symbol(self):
+        return self.tree.symbols[self.tree.symbol_of(self.index)]
+    
+    @property
+    def rule(self):
+        """Index of the production this node was reduced by, or None for a token"""
+        rule = self.tree.rules[self.index]
+        return rule if rule >= 0 else None
+    
+    @property
+    def production(self):
+        rule = self.rule
+        return self.tree.productions[rule] if rule is not None else None
+    
+    @property
+    def span(self):
+        return self.tree.starts[self.index], self.tree.ends[self.index]
+    
+    @property
+    def text(self):
+        return self.tree.source[self.tree.starts[self.index]:self.tree.ends[self.index]]
+    
+    @property
+    def children(self):
+        tree = self.tree
+        first = tree.first_child[self.index]
+        return [ParseNode(tree, child) for child in tree.children[first:first + tree.child_count[self.index]]]
+    
+    def __len__(self):
+        return self.tree.child_count[self.index]
+    
+    def __iter__(self):
+        return iter(self.children)
+    
+    def __eq__(self, other):
+        return isinstance(other, ParseNode) and self.tree is other.tree and self.index == other.index
+    
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+    
+    def __repr__(self):
+        start, end = self.span
+        return f"ParseNode({self.production or self.symbol!r}, {start}:{end})"
+
+class GSSNode:
+    """Node of a graph-structured stack: an LR state reached at a token level"""
+    __slots__ = ('state', 'level', 'edges')
+    
+    def __init__(self, state, level):
+        self.state = state
+        self.level = level
+        self.edges = {}   # node below -> forest node of the symbol between them
+
+def unlink_labels(labels):
+    """The labels of a linked (label, rest) path, deepest first, which is their input order"""
+    result = []
+    while labels:
+        label, labels = labels
+        result.append(label)
+    return tuple(result)
+
+class ParseForest:
+    """Shared packed parse forest built by the GLR driver
+    
+    Forest nodes are (symbol, first token, end token) tuples, shared by every
+    derivation of that symbol over that span. families maps each
+    non-terminal node to its packed alternatives, a set of
+    (production, children) pairs; token nodes have none.
+    """
+    def __init__(self, parser, source):
+        self.symbols = parser.symbols
+        self.productions = parser.production_list
+        self.source = source
+        self.starts = []   # offset of each token, then of the end marker
+        self.ends = []
+        self.families = {}
+        self.root = None
+    
+    def add(self, node, prod, children):
+        self.families.setdefault(node, set()).add((prod, children))
+    
+    def span(self, node):
+        """Input offsets covered by a forest node"""
+        _, first, end = node
+        if first == end:
+            return self.starts[first], self.starts[first]
+        return self.starts[first], self.ends[end - 1]
+    
+    def count(self):
+        """Number of distinct parse trees, or None if a cycle makes it infinite"""
+        if self.root is None:
+            return 0
+        families = self.families
+        counts = {}
+        stack = [(self.root, False)]
+        
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                total = 0
+                for prod, children in families[node]:
+                    product = 1
+                    for child in children:
+                        product *= counts[child]
+                    total += product
+                counts[node] = total
+                continue
+            
+            if node in counts:
+                if counts[node] is None:
+                    return None   # the node is its own descendant
+                continue
+            if node not in families:
+                counts[node] = 1
+                continue
+            counts[node] = None
+            stack.append((node, True))
+            for prod, children in families[node]:
+                stack.extend((child, False) for child in children)
+        
+        return counts[self.root]
+    
+    def to_dict(self):
+        """JSON-ready export: a flat node list, each family referring to child nodes by index"""
+        if self.root is None:
+            return None
+        index = {self.root: 0}
+        order = [self.root]
+        nodes = []
+        
+        for node in order:
+            families = []
+            for prod, children in sorted(self.families.get(node, ())):
+                for child in children:
+                    if child not in index:
+                        index[child] = len(order)
+                        order.append(child)
+                families.append({'rule': prod, 'children': [index[child] for child in children]})
+            nodes.append({'symbol': self.symbols[node[0]], 'span': list(self.span(node)), 'families': families})
+        
+        return {'root': 0, 'productions': self.productions, 'nodes': nodes}
+
+class IncrementalParser:
+    """Push parser over a compiled CLRParser: feed() chunks of input, then finish()
+
+    The state stack is kept between calls, so memory does not grow with the
+    input already consumed. A rejection is reported by the feed() call that
+    hits it; acceptance can only be known at finish(). With a lexer, a token
+    that may continue into the next chunk is held back until it arrives.
+    """
+    def __init__(self, parser):
+        self.parser = parser
+        self.states = array('i', [0])
+        self.position = 0       # input offset consumed so far
+        self.pending = ''       # unscanned tail of the last chunk (lexer only)
+        self.step_count = 0
+        self.result = None      # ParseResult once the outcome is known
+    
+    def feed(self, chunk):
+        """Consume a chunk of input; returns the ParseResult if it was rejected, else None"""
+        if self.result is not None:
+            return self.result
+        
+        lexer = self.parser.lexer
+        if lexer is None:
+            symbol_index, n_terminals, position = self.parser.symbol_index, self.parser.n_terminals, self.position
+            self.shift_tokens((symbol_index.get(symbol, n_terminals), position + i, position + i + 1)
+                              for i, symbol in enumerate(chunk))
+            if self.result is None:
+                self.position += len(chunk)
+            return self.result
+        
+        text = self.pending + chunk if self.pending else chunk
+        position, resume = self.position, 0
+        
+        def scanned():
+            # The scan returns how far it got, including skipped text it dropped
+            nonlocal resume
+            tokens = lexer.tokens(text, 0, final=False)
+            while True:
+                try:
+                    column, start, stop = next(tokens)
+                except StopIteration as done:
+                    resume = done.value
+                    return
+                yield column, position + start, position + stop
+        
+        self.shift_tokens(scanned())
+        if self.result is None:
+            self.pending = text[resume:]
+            self.position += resume
+        return self.result
+    
+    def shift_tokens(self, tokens, end=None):
+        """Run the driver over (column, start, end) tokens, which are the rest of the input if `end` is given"""
+        result = self.parser.recognize_tokens(tokens, end, self.states, self.step_count)
+        self.step_count = result.step_count
+        if result.accepted is not None:
+            self.result = result
+            if not result.accepted:
+                self.position = result.error_position
+    
+    def finish(self):
+        """Signal the end of the input and return the final ParseResult"""
+        if self.result is None:
+            lexer, position, text = self.parser.lexer, self.position, self.pending
+            self.pending = ''
+            tokens = ()
+            if lexer is not None and text:
+                tokens = ((column, position + start, position + stop) for column, start, stop in lexer.tokens(text))
+            self.shift_tokens(tokens, position + len(text))
+        return self.result
+
+class Lexer:
+    """Scanner for grammars with a token section: one combined regex over all terminals
+
+    Terminals declared with %token match their regex, %skip patterns are
+    dropped, and every other terminal matches literally. Literals are tried
+    first, longest first, and literals ending in a word character only
+    match at a word boundary, so keywords do not eat identifiers.
+    """
+    # Text that might still become a token is an error once it is this long
+    MAX_TOKEN = 65536
+    
+    def __init__(self, terminals, patterns, skip):
+        self.columns = {}
+        alternatives = []
+        literals = sorted((t for t in terminals if t not in patterns and t != '$'), key=len, reverse=True)
+        
+        for symbol in literals + [t for t in patterns if t in terminals]:
+            group = f"t{len(alternatives)}"
+            if symbol in patterns:
+                regex = patterns[symbol]
+            else:
+                regex = re.escape(symbol) + (r'(?!\w)' if re.match(r'\w', symbol[-1]) else '')
+            self.columns[group] = terminals.index(symbol)
+            alternatives.append(f"(?P<{group}>{regex})")
+        
+        self.token_source = '|'.join(alternatives) or '(?!)'
+        for regex in skip:
+            alternatives.append(f"(?P<skip{len(alternatives)}>{regex})")
+        
+        self.error_column = len(terminals)
+        self.source = '|'.join(alternatives) or '(?!)'
+        self.pattern = re.compile(self.source)
+        self.bytes_pattern = None
+        self.parsed = {}          # source -> parsed regex, for could_continue
+    
+    def matcher(self, data):
+        """The match function of the combined regex for str or bytes-like data"""
+        if isinstance(data, str):
+            return self.pattern.match
+        if self.bytes_pattern is None:
+            self.bytes_pattern = re.compile(self.source.encode('utf-8'))
+        return self.bytes_pattern.match
+    
+    def tokens(self, data, pos=0, final=True):
+        """Yield (column, start, end) for each token of a str or bytes-like input
+        
+        Works on str, bytes, memoryview and mmap data without copying. An
+        unmatched character yields the error column and ends the scan. With
+        final=False, the text from the first token that more input might
+        still extend or complete is held back, and the generator returns
+        the offset it was scanned up to; an unmatched character is only an
+        error once no more input could make it part of a token. Either way,
+        held-back text longer than MAX_TOKEN is an error.
+        """
+        match = self.matcher(data)
+        columns = self.columns
+        end = len(data)
+        held = None        # with final=False, the last token, until nothing after it can extend it
+        
+        while pos < end:
+            m = match(data, pos)
+            stop = m.end() if m is not None else pos
+            if stop == pos:
+                break
+            if stop == end and not final:
+                if stop - pos > self.MAX_TOKEN:
+                    break
+                if m.lastgroup in columns or not self.skip_ends(data, pos, end, m.lastgroup):
+                    break
+            
+            column = columns.get(m.lastgroup)
+            if column is not None:
+                if final:
+                    yield column, pos, stop
+                else:
+                    if held is not None:
+                        yield held
+                    held = column, pos, stop
+            pos = stop
+        
+        if final:
+            if pos < end:
+                yield self.error_column, pos, pos
+            return
+        
+        if held is not None:
+            if end - held[1] <= self.MAX_TOKEN and self.could_continue(data, held[1], end):
+                return held[1]
+            yield held
+        if pos < end and (end - pos > self.MAX_TOKEN or stop == pos and not self.could_continue(data, pos, end)):
+            yield self.error_column, pos, pos
+        return pos
+    
+    def skip_ends(self, data, pos, end, group):
+        """Whether skipped text running from pos to the end of the data can be dropped now
+        
+        That is when no token could start at pos whatever follows, and the
+        last character alone is a match of the same skip pattern, so that
+        scanning on from the end skips the rest of the run just the same.
+        """
+        m = self.matcher(data)(data, end - 1)
+        if m is None or m.end() != end or m.lastgroup != group:
+            return False
+        return not self.could_continue(data, pos, end, self.token_source)
+    
+    def could_continue(self, data, pos, end, source=None):
+        """Whether some token could match at pos if more data followed data[pos:end]
+        
+        Runs the parsed regex (by default the combined one) over the text,
+        as a set of offsets per step: a token is still possible if some path
+        wants a character past the end. Lookarounds, case and anything
+        unusual count as a match, so in doubt the text is held back.
+        """
+        source = source or self.source
+        parsed = self.parsed.get(source)
+        if parsed is None:
+            parsed = self.parsed[source] = sre_parse.parse(source)
+        try:
+            regex_offsets(parsed, {pos}, data, end)
+        except EOFError:
+            return True
+        return False
+
+# Opcodes of the parsed regex that consume one character
+CHARACTER_OPCODES = {sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN}
+REPEAT_OPCODES = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None)} - {None}
+CATEGORY_TESTS = {
+    sre_parse.CATEGORY_DIGIT: str.isdecimal,
+    sre_parse.CATEGORY_NOT_DIGIT: lambda char: not char.isdecimal(),
+    sre_parse.CATEGORY_SPACE: str.isspace,
+    sre_parse.CATEGORY_NOT_SPACE: lambda char: not char.isspace(),
+    sre_parse.CATEGORY_WORD: lambda char: char.isalnum() or char == '_',
+    sre_parse.CATEGORY_NOT_WORD: lambda char: not (char.isalnum() or char == '_'),
+    sre_parse.CATEGORY_LINEBREAK: lambda char: char == '\n',
+    sre_parse.CATEGORY_NOT_LINEBREAK: lambda char: char != '\n'
+}
+
+def regex_offsets(items, offsets, data, end):
+    """The offsets reached by matching parsed regex items from each of `offsets`
+    
+    Raises EOFError when a path needs the character at `end`.
+    """
+    for op, av in items:
+        if not offsets:
+            break
+        if op in CHARACTER_OPCODES:
+            if end in offsets:
+                raise EOFError
+            offsets = {i + 1 for i in offsets if regex_char_matches(op, av, data[i])}
+        elif op == sre_parse.BRANCH:
+            offsets = set().union(*(regex_offsets(branch, offsets, data, end) for branch in av[1]))
+        elif op == sre_parse.SUBPATTERN:
+            offsets = regex_offsets(av[-1], offsets, data, end)
+        elif op in REPEAT_OPCODES:
+            low, high, body = av
+            for _ in range(low):
+                offsets = regex_offsets(body, offsets, data, end)
+            reached, frontier, count = set(offsets), offsets, low
+            while frontier and (high == sre_parse.MAXREPEAT or count < high):
+                frontier = regex_offsets(body, frontier, data, end) - reached
+                reached |= frontier
+                count += 1
+            offsets = reached
+        elif op not in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            # Backreferences, conditionals and the like: assume they match here
+            raise EOFError
+    return offsets
+
+def regex_char_matches(op, av, char):
+    """Whether a one-character opcode can match char, in either case"""
+    if not isinstance(char, str):
+        if char >= 0x80:
+            return True   # part of a UTF-8 sequence, while the regex is over characters
+        char = chr(char)
+    if op == sre_parse.ANY:
+        return True
+    
+    variants = [variant for variant in (char, char.lower(), char.upper()) if len(variant) == 1]
+    if op == sre_parse.LITERAL:
+        return any(ord(variant) == av for variant in variants)
+    if op == sre_parse.NOT_LITERAL:
+        return any(ord(variant) != av for variant in variants)
+    negate = bool(av) and av[0][0] == sre_parse.NEGATE
+    return any(regex_set_contains(av, variant) != negate for variant in variants)
+
+def regex_set_contains(av, char):
+    """Whether a character set (the argument of IN) contains char, NEGATE aside"""
+    for op, arg in av:
+        if op == sre_parse.LITERAL:
+            if ord(char) == arg:
+                return True
+        elif op == sre_parse.RANGE:
+            if arg[0] <= ord(char) <= arg[1]:
+                return True
+        elif op == sre_parse.CATEGORY and arg in CATEGORY_TESTS:
+            if CATEGORY_TESTS[arg](char):
+                return True
+        elif op != sre_parse.NEGATE:
+            raise EOFError
+    return False
+
+class GrammarAnalysis:
+    """Nullable, FIRST and FOLLOW sets over an encoded grammar, as terminal bitmasks"""
+    def __init__(self, n_terminals, n_symbols, prod_heads, prod_bodies, start, end_marker):
+        self.n_terminals = n_terminals
+        self.nullable = [False] * n_symbols
+        self.first = [1 << i if i < n_terminals else 0 for i in range(n_symbols)]
+        self.follow = [0] * n_symbols
+        self.follow[start] = 1 << end_marker
+        
+        self._index(prod_heads, prod_bodies)
+        everything = range(len(self.productions))
+        self._compute_nullable(everything)
+        self._compute_first(everything)
+        self._compute_follow(everything)
+        self.changed = set(range(n_terminals, n_symbols))   # non-terminals whose nullable or FIRST is new
+        self.recomputed = len(self.changed)
+    
+    @classmethod
+    def edited(cls, base, n_terminals, prod_heads, prod_bodies, start, end_marker, changed):
+        """The analysis of an edited grammar, redoing only the sets the edit can change
+        
+        base is the earlier (nullable, first, follow) lists, in the new symbol
+        ids, and changed the (head, body) of every added or removed
+        production. Nullable and FIRST are redone for the heads of changed
+        productions and the heads whose bodies use them, FOLLOW for the
+        symbols next to a changed symbol and the bodies their FOLLOW flows
+        into. Every other set is kept.
+        """
+        self = cls.__new__(cls)
+        self.n_terminals = n_terminals
+        self.nullable, self.first, self.follow = (list(values) for values in base)
+        self._index(prod_heads, prod_bodies)
+        productions, used_in, by_head = self.productions, self.used_in, self.by_head
+        
+        # Nullable and FIRST flow from bodies up to heads
+        affected = set()
+        work = [head for head, body in changed if head is not None]
+        while work:
+            symbol = work.pop()
+            if symbol not in affected:
+                affected.add(symbol)
+                work.extend(productions[i][0] for i in used_in.get(symbol, ()))
+        for symbol in affected:
+            self.nullable[symbol] = False
+            self.first[symbol] = 0
+        first_productions = [i for symbol in affected for i in by_head.get(symbol, ())]
+        self._compute_nullable(first_productions)
+        self._compute_first(first_productions)
+        self.changed = {symbol for symbol in affected
+                        if (self.nullable[symbol], self.first[symbol]) != (base[0][symbol], base[1][symbol])}
+        
+        # FOLLOW flows from heads down to bodies, and from trailers to the symbols before them
+        seeds = [symbol for head, body in changed for symbol in body if symbol >= n_terminals]
+        for symbol in self.changed:
+            for i in used_in.get(symbol, ()):
+                seeds.extend(s for s in productions[i][1] if s >= n_terminals)
+        follows = set()
+        while seeds:
+            symbol = seeds.pop()
+            if symbol not in follows:
+                follows.add(symbol)
+                for i in by_head.get(symbol, ()):
+                    seeds.extend(s for s in productions[i][1] if s >= n_terminals)
+        for symbol in follows:
+            self.follow[symbol] = 1 << end_marker if symbol == start else 0
+        self._compute_follow({i for symbol in follows for i in used_in.get(symbol, ())})
+        
+        self.recomputed = len(affected | follows)
+        return self
+    
+    def _index(self, prod_heads, prod_bodies):
+        """Index the productions by head and by the non-terminals in their bodies"""
+        self.productions = list(zip(prod_heads, prod_bodies))
+        self.used_in = {}   # non-terminal -> productions whose body has it
+        self.by_head = {}   # non-terminal -> its productions
+        for i, (head, body) in enumerate(self.productions):
+            self.by_head.setdefault(head, []).append(i)
+            for symbol in set(body):
+                if symbol >= self.n_terminals:
+                    self.used_in.setdefault(symbol, []).append(i)
+    
+    # Each fixed point starts from a worklist of production indices, and a
+    # production is revisited only when a set it reads has grown
+    
+    def _compute_nullable(self, work):
+        """A non-terminal is nullable if some body consists of nullable symbols only"""
+        nullable, productions, used_in = self.nullable, self.productions, self.used_in
+        work = list(work)
+        while work:
+            head, body = productions[work.pop()]
+            if not nullable[head] and all(nullable[symbol] for symbol in body):
+                nullable[head] = True
+                work.extend(used_in.get(head, ()))
+    
+    def _compute_first(self, work):
+        """Iterate FIRST(A) |= FIRST(body) for every production A -> body until stable"""
+        first, productions, used_in = self.first, self.productions, self.used_in
+        work = list(work)
+        while work:
+            head, body = productions[work.pop()]
+            mask = first[head] | self.first_of(body)
+            if mask != first[head]:
+                first[head] = mask
+                work.extend(used_in.get(head, ()))
+    
+    def _compute_follow(self, work):
+        """Iterate FOLLOW(B) |= FIRST(β) (and FOLLOW(A) if β is nullable) for A -> αBβ"""
+        first, follow, nullable = self.first, self.follow, self.nullable
+        productions, by_head = self.productions, self.by_head
+        n_terminals = self.n_terminals
+        work = list(work)
+        while work:
+            head, body = productions[work.pop()]
+            # Walk the body right to left carrying what can follow each symbol
+            trailer = follow[head]
+            for symbol in reversed(body):
+                if symbol >= n_terminals:
+                    if follow[symbol] | trailer != follow[symbol]:
+                        follow[symbol] |= trailer
+                        work.extend(by_head.get(symbol, ()))
+                    trailer = trailer | first[symbol] if nullable[symbol] else first[symbol]
+                else:
+                    trailer = first[symbol]
+    
+    def first_of(self, symbols, start=0, lookahead=0):
+        """FIRST of symbols[start:], followed by the lookahead set if that string is nullable"""
+        first, nullable = self.first, self.nullable
+        mask = 0
+        for i in range(start, len(symbols)):
+            symbol = symbols[i]
+            mask |= first[symbol]
+            if not nullable[symbol]:
+                return mask
+        return mask | lookahead
+    
+    def is_nullable(self, symbols, start=0):
+        """Whether symbols[start:] can derive the empty string"""
+        return all(self.nullable[symbols[i]] for i in range(start, len(symbols)))
+
+def edit_grammar(grammar, added=(), removed=()):
+    """A production list with one occurrence of each removed production dropped and the added ones appended"""
+    grammar = list(grammar)
+    for production in removed:
+        if production not in grammar:
+            raise ValueError(f"Production not in the grammar: {production!r}")
+        grammar.remove(production)
+    return grammar + list(added)
+
+class GrammarEdit:
+    """Maps the ids, bitmasks and closures of an earlier build onto an edited grammar
+    
+    Productions are matched by their text, occurrence by occurrence, and
+    symbols by name; a production or symbol of the earlier grammar that
+    is gone maps to None. When no id moved, values are shared as they are.
+    """
+    def __init__(self, base, parser):
+        self.base = base
+        self.parser = parser
+        self.symbols = [parser.symbol_index.get(symbol) for symbol in base.symbols]
+        positions = {}
+        for i, production in enumerate(parser.production_list):
+            positions.setdefault(production, []).append(i)
+        for indices in positions.values():
+            indices.reverse()
+        self.prods = [positions[p].pop() if positions.get(p) else None for p in base.production_list]
+        self.added = sorted(set(range(len(parser.production_list))).difference(self.prods))
+        self.removed = [prod for prod, new in enumerate(self.prods) if new is None]
+        
+        # Lookahead bits are the terminals, then the probe bit of closure
+        # templates. Kept bits are moved in runs of consecutive bits
+        bits = self.symbols[:base.n_terminals] + [parser.n_terminals]
+        self.removed_bits = sum(1 << old for old, new in enumerate(bits) if new is None)
+        self.runs = []   # [old first bit, new first bit, bit count]
+        for old, new in enumerate(bits):
+            if new is None:
+                continue
+            if self.runs and self.runs[-1][0] + self.runs[-1][2] == old and self.runs[-1][1] + self.runs[-1][2] == new:
+                self.runs[-1][2] += 1
+            else:
+                self.runs.append([old, new, 1])
+        self.runs = [(old, new, (1 << count) - 1) for old, new, count in self.runs]
+        self.identity = (all(new == old for old, new in enumerate(self.symbols) if new is not None)
+                         and all(new == old for old, new in enumerate(self.prods) if new is not None)
+                         and self.runs == [(0, 0, (1 << (base.n_terminals + 1)) - 1)])
+        
+        # Reuse needs the same reading of the productions, the same start
+        # production and no symbol that turned from terminal to non-terminal
+        self.compatible = (base.uses_tokens == parser.uses_tokens and self.prods[0] == 0
+                           and getattr(base, 'analysis', None) is not None
+                           and all(new is None or (old < base.n_terminals) == (new < parser.n_terminals)
+                                   for old, new in enumerate(self.symbols)))
+    
+    def mask(self, mask, removed=None):
+        """A lookahead bitmask in the new bits; a removed terminal makes it None, or sets `removed` instead"""
+        if self.identity:
+            return mask
+        result = 0
+        if mask & self.removed_bits:
+            if removed is None:
+                return None
+            result = removed
+        for old, new, run in self.runs:
+            result |= ((mask >> old) & run) << new
+        return result
+    
+    def kernel(self, kernel):
+        """A kernel in the new ids, or None if it uses a removed production or terminal"""
+        if self.identity:
+            return kernel
+        items = []
+        for prod, dot, lookahead in kernel:
+            prod, lookahead = self.prods[prod], self.mask(lookahead)
+            if prod is None or lookahead is None:
+                return None
+            items.append(Item(prod, dot, lookahead))
+        return tuple(sorted(items))
+    
+    def closure(self, items):
+        """A {(prod, dot): lookahead} closure in the new ids, or None"""
+        if self.identity:
+            return items
+        result = {}
+        for (prod, dot), lookahead in items.items():
+            prod, lookahead = self.prods[prod], self.mask(lookahead)
+            if prod is None or lookahead is None:
+                return None
+            result[(prod, dot)] = lookahead
+        return result
+    
+    def analysis(self):
+        """The earlier (nullable, first, follow) lists in the new symbol ids, and the changed productions"""
+        base, parser = self.base.analysis, self.parser
+        n_symbols, n_terminals = len(parser.symbols), parser.n_terminals
+        nullable = [False] * n_symbols
+        first = [1 << i if i < n_terminals else 0 for i in range(n_symbols)]
+        follow = [0] * n_symbols
+        # A set that held a removed terminal gets the probe bit, so that it
+        # compares as changed; such sets are always recomputed
+        probe = 1 << n_terminals
+        for old, new in enumerate(self.symbols):
+            if new is not None and new >= n_terminals:
+                nullable[new] = base.nullable[old]
+                first[new] = self.mask(base.first[old], probe)
+                follow[new] = self.mask(base.follow[old], probe)
+        
+        changed = [(parser.prod_heads[prod], parser.prod_bodies[prod]) for prod in self.added]
+        for prod in self.removed:
+            body = tuple(self.symbols[s] for s in self.base.prod_bodies[prod] if self.symbols[s] is not None)
+            changed.append((self.symbols[self.base.prod_heads[prod]], body))
+        return (nullable, first, follow), changed
+    
+    def seed(self):
+        """Copy the closures, templates and CLR(1) successors the edit leaves unchanged into the parser
+        
+        Expanding a non-terminal depends on its productions and on FIRST of
+        the symbols after it, so a closure is kept if no item in it expands
+        a non-terminal whose productions changed or is followed by a
+        symbol whose nullable or FIRST changed. Returns the number of
+        closures and of states whose successors were reused.
+        """
+        base, parser = self.base, self.parser
+        old_ids = {new: old for old, new in enumerate(self.symbols) if new is not None}
+        changed_heads = {base.prod_heads[prod] for prod in self.removed}
+        changed_heads.update(old_ids[parser.prod_heads[prod]] for prod in self.added
+                             if parser.prod_heads[prod] in old_ids)
+        changed_first = {old_ids[symbol] for symbol in parser.analysis.changed if symbol in old_ids}
+        bodies, n_terminals = base.prod_bodies, base.n_terminals
+        
+        def expands_same(prod, dot):
+            # Whether the symbol after the dot expands to the same items as before
+            body = bodies[prod]
+            return (dot == len(body) or body[dot] < n_terminals
+                    or body[dot] not in changed_heads and changed_first.isdisjoint(body[dot + 1:]))
+        
+        # A template already holds every item its expansion reaches
+        templates = {symbol: template for symbol, template in list(base.closure_templates.items())
+                     if symbol not in changed_heads and self.symbols[symbol] is not None
+                     and all(self.prods[prod] is not None and expands_same(prod, dot) for (prod, dot), _, _ in template)}
+        for symbol, template in templates.items():
+            parser.closure_templates[self.symbols[symbol]] = template if self.identity else [
+                ((self.prods[prod], dot), self.mask(spontaneous, 0), propagates)
+                for (prod, dot), spontaneous, propagates in template]
+        
+        def closes_same(prod, dot):
+            # Whether a kernel item contributes the same items to its closure
+            body = bodies[prod]
+            return (self.prods[prod] is not None and expands_same(prod, dot)
+                    and (dot == len(body) or body[dot] < n_terminals or body[dot] in templates))
+        
+        kernels = {}   # old kernel -> new kernel, for the ones whose closure is kept
+        for kernel, items in list(base.closures.items()):
+            if all(closes_same(item.prod, item.dot) for item in kernel):
+                new_kernel, new_items = self.kernel(kernel), self.closure(items)
+                if new_kernel is not None and new_items is not None:
+                    kernels[kernel] = new_kernel
+                    parser.closures[new_kernel] = new_items
+        
+        # A CLR(1) state with the same closure has the same successors
+        reused_states = 0
+        if base.mode == 'clr':
+            rank = parser.symbol_rank
+            expanded = getattr(base.table, 'expanded', None)   # a lazy table may be mid-expansion
+            for s in list(base.states):
+                if s.kernel not in kernels or expanded is not None and not expanded[s.no]:
+                    continue
+                successors = [(self.symbols[symbol], kernels.get(base.states[target].kernel) or
+                               self.kernel(base.states[target].kernel)) for symbol, target in s.transitions.items()]
+                if all(kernel is not None for symbol, kernel in successors):
+                    successors.sort(key=lambda successor: rank[successor[0]])
+                    parser.reused_successors[kernels[s.kernel]] = successors
+                    reused_states += 1
+        
+        return len(kernels), reused_states
 
 class CLRParser:
     def __init__(self):
+        self.grammar = []
         self.production_list = []
         self.nt_list = OrderedDict()  # Non-terminals
         self.t_list = OrderedDict()   # Terminals
         self.parsing_steps = []
+        self.trace_truncated = False
         self.is_accepted = False
-        self.parsing_table = {}
+        self.error_position = None
+        self.lexer = None
+        self.build_timings = OrderedDict()   # build phase -> seconds
+        self.closure_calls = 0
+        self.closure_hits = 0
+        self.reused_closures = 0
+        self.reused_states = 0
+        self.table = None
+        self._table_view = None
+        self.mode = 'clr'
+        self.states = []
+        self.minimize_stats = None
+        self.mode_comparison = None   # compare_modes() result, once asked for
         
     def parse_grammar(self, grammar: List[str]):
-        """Parse the grammar productions"""
+        """Parse the grammar productions and the optional token section"""
+        self.grammar = normalize_grammar(grammar)
         self.production_list = []
         self.nt_list = OrderedDict() 
         self.t_list = OrderedDict()
+        self.token_patterns = OrderedDict()
+        self.skip_patterns = []
         
-        for production in grammar:
-            if not production or production.lower() == 'end':
-                continue
-                
+        # Token definitions: "%token NAME regex" and "%skip regex"
+        productions = []
+        for production in self.grammar:
+            if production.startswith('%'):
+                self.parse_directive(production)
+            else:
+                productions.append(production)
+        
+        # With a token section, bodies are whitespace-separated symbols and
+        # the non-terminals are exactly the symbols that head a production
+        self.uses_tokens = bool(self.token_patterns or self.skip_patterns)
+        heads = {self.split_production(p)[0] for p in productions} if self.uses_tokens else set()
+        
+        for production in productions:
             self.production_list.append(production)
-            head, body = production.split('->')
+            head, body = self.split_production(production)
             
             # Add head to non-terminals if not already there
             if head not in self.nt_list:
@@ -62,403 +1381,1096 @@ class CLRParser:
             
             # Add all terminals in body
             for symbol in body:
-                if not (65 <= ord(symbol) <= 90):  # Not uppercase letter
+                if self.uses_tokens:
+                    is_terminal = symbol not in heads
+                else:
+                    is_terminal = not (65 <= ord(symbol) <= 90)  # Not uppercase letter
+                
+                if is_terminal:
                     if symbol not in self.t_list:
                         self.t_list[symbol] = Terminal(symbol)
                 elif symbol not in self.nt_list:
                     self.nt_list[symbol] = NonTerminal(symbol)
     
+    def parse_directive(self, line):
+        """Record a %token or %skip line of the token section"""
+        parts = line.split(None, 2)
+        if parts[0] == '%token' and len(parts) == 3:
+            re.compile(parts[2])
+            self.token_patterns[parts[1]] = parts[2]
+        elif parts[0] == '%skip' and len(parts) >= 2:
+            regex = line.split(None, 1)[1]
+            re.compile(regex)
+            self.skip_patterns.append(regex)
+        else:
+            raise ValueError(f"Invalid grammar directive: {line!r} (expected '%token NAME regex' or '%skip regex')")
+    
+    def split_production(self, production):
+        """Split a production into its head and its list of body symbols"""
+        head, body = production.split('->', 1)
+        if self.uses_tokens:
+            return head.strip(), body.split()
+        return head, list(body)
+    
+    def compute_first_follow(self, edit=None):
+        """Compute nullable, FIRST and FOLLOW sets for all non-terminals
+        
+        With a GrammarEdit from an earlier build, only the sets the edit can
+        change are recomputed.
+        """
+        if edit is None:
+            self.analysis = GrammarAnalysis(self.n_terminals, len(self.symbols), self.prod_heads,
+                                            self.prod_bodies, self.prod_heads[0], self.end_marker)
+        else:
+            base, changed = edit.analysis()
+            self.analysis = GrammarAnalysis.edited(base, self.n_terminals, self.prod_heads, self.prod_bodies,
+                                                   self.prod_heads[0], self.end_marker, changed)
+        self.closure_templates = {}   # non-terminal -> items its expansion adds
+        self.closures = {}            # kernel -> closure, shared by every construction
+        self.reused_successors = {}   # kernel -> successors kept from an earlier build
+        self.closure_calls = 0
+        self.closure_hits = 0
+        self.reused_closures = 0
+        self.reused_states = 0
+        
+        # Mirror the bitmasks into the NonTerminal objects for display
+        for nt, obj in self.nt_list.items():
+            nt_id = self.symbol_index[nt]
+            obj.first = {self.symbols[t] for t in iter_bits(self.analysis.first[nt_id])}
+            if self.analysis.nullable[nt_id]:
+                obj.first.add('ε')
+            obj.follow = {self.symbols[t] for t in iter_bits(self.analysis.follow[nt_id])}
+    
     def compute_first(self, symbol):
         """Compute FIRST set for a given symbol"""
-        # If symbol is a terminal, return itself
         if symbol in self.t_list:
             return {symbol}
-            
-        # If we've already computed FIRST for this non-terminal, return it
-        if symbol in self.nt_list and self.nt_list[symbol].first:
-            return self.nt_list[symbol].first
-            
-        # Compute FIRST set for non-terminal
-        for prod in self.production_list:
-            head, body = prod.split('->')
-            
-            if head != symbol:
-                continue
-                
-            # If X -> ε is a production, add ε to FIRST(X)
-            if body == '':
-                self.nt_list[symbol].add_first('ε')
-                continue
-                
-            # For each production X -> Y1 Y2 ... Yn
-            for i, Y in enumerate(body):
-                # Skip if Y is the same as X (left recursion)
-                if Y == symbol:
-                    continue
-                    
-                # Add FIRST(Y) - {ε} to FIRST(X)
-                first_y = self.compute_first(Y)
-                self.nt_list[symbol].add_first(first_y - {'ε'})
-                
-                # If ε is not in FIRST(Y), break
-                if 'ε' not in first_y:
-                    break
-                    
-                # If Y1...Yn all have ε in their FIRST sets, add ε to FIRST(X)
-                if i == len(body) - 1:
-                    self.nt_list[symbol].add_first({'ε'})
-                    
         return self.nt_list[symbol].first
     
     def compute_follow(self, symbol):
         """Compute FOLLOW set for a given non-terminal"""
-        # If symbol is a terminal, return None
         if symbol in self.t_list:
             return None
-            
-        # If we're computing FOLLOW for the start symbol, add $ to its FOLLOW set
-        if symbol == list(self.nt_list.keys())[0]:
-            self.nt_list[symbol].add_follow({'$'})
-            
-        # For each production in the grammar
-        for prod in self.production_list:
-            head, body = prod.split('->')
-            
-            # For each occurrence of symbol in the body
-            for i, B in enumerate(body):
-                if B != symbol:
-                    continue
-                    
-                # If A -> αBβ, add FIRST(β) - {ε} to FOLLOW(B)
-                if i < len(body) - 1:
-                    first_beta = self.compute_first(body[i+1])
-                    self.nt_list[symbol].add_follow(first_beta - {'ε'})
-                    
-                    # If ε is in FIRST(β), add FOLLOW(A) to FOLLOW(B)
-                    if 'ε' in first_beta and B != head:
-                        self.nt_list[symbol].add_follow(self.compute_follow(head))
-                
-                # If A -> αB, add FOLLOW(A) to FOLLOW(B)
-                elif i == len(body) - 1 and B != head:
-                    self.nt_list[symbol].add_follow(self.compute_follow(head))
-                    
         return self.nt_list[symbol].follow
     
     def augment_grammar(self):
         """Augment the grammar with a new start symbol"""
         for i in range(ord('Z'), ord('A')-1, -1):
-            if chr(i) not in self.nt_list:
+            if chr(i) not in self.nt_list and chr(i) not in self.t_list:
                 start_prod = self.production_list[0]
-                self.production_list.insert(0, chr(i) + '->' + start_prod.split('->')[0])
+                self.production_list.insert(0, chr(i) + '->' + self.split_production(start_prod)[0])
                 self.nt_list[chr(i)] = NonTerminal(chr(i))
                 return
     
-    def closure(self, items):
-        """Compute the closure of a set of items"""
-        def exists(newitem, items):
-            for i in items:
-                if i == newitem and sorted(i.lookahead) == sorted(newitem.lookahead):
-                    return True
-            return False
+    def encode_grammar(self):
+        """Map symbols to integer ids and productions to (head, body) id tuples"""
+        # Terminals (and the end marker) take ids 0..n_terminals-1 so that
+        # lookahead sets can be stored as bitmasks indexed by symbol id
+        terminals = list(self.t_list.keys())
+        if '$' not in self.t_list:
+            terminals.append('$')
+        self.symbols = terminals + list(self.nt_list.keys())
+        self.n_terminals = len(terminals)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        # Order in which a state's successors are created (non-terminals, then
+        # terminals, in grammar order), which fixes the state numbering
+        self.symbol_rank = {self.symbol_index[symbol]: rank for rank, symbol
+                            in enumerate(list(self.nt_list.keys()) + list(self.t_list.keys()))}
+        self.end_marker = self.symbol_index['$']
         
-        while True:
-            flag = 0
-            for i in items:
-                # Skip if dot is at the end
-                if i.index('.') == len(i) - 1:
-                    continue
-                
-                # Get the symbol after the dot
-                Y = i.split('->')[1].split('.')[1][0]
-                
-                # Compute lookahead for this symbol
-                if i.index('.') + 1 < len(i) - 1:
-                    next_symbol = i[i.index('.') + 2]
-                    lastr = list(self.compute_first(next_symbol) - {'ε'})
-                else:
-                    lastr = i.lookahead
-                
-                # Add items of the form Y -> .γ to the closure
-                for prod in self.production_list:
-                    head, body = prod.split('->')
-                    
-                    if head != Y:
-                        continue
-                    
-                    newitem = Item(Y + '->.' + body, lastr)
-                    
-                    if not exists(newitem, items):
-                        items.append(newitem)
-                        flag = 1
-            
-            if flag == 0:
-                break
+        self.prod_heads = []
+        self.prod_bodies = []
+        self.prods_by_head = {self.symbol_index[nt]: [] for nt in self.nt_list}
+        
+        for i, prod in enumerate(self.production_list):
+            head, body = self.split_production(prod)
+            head_id = self.symbol_index[head]
+            self.prod_heads.append(head_id)
+            self.prod_bodies.append(tuple(self.symbol_index[symbol] for symbol in body))
+            self.prods_by_head[head_id].append(i)
+        
+        self.lexer = Lexer(terminals, self.token_patterns, self.skip_patterns) if self.uses_tokens else None
+    
+    def closure(self, kernel):
+        """Compute the closure of a kernel as a {(prod, dot): lookahead bitmask} map
+        
+        Closures are memoized by kernel, and each non-terminal after a dot is
+        expanded by applying its closure template, so the cost follows the
+        size of the closure rather than the number of passes over it.
+        """
+        self.closure_calls += 1
+        items = self.closures.get(kernel)
+        if items is not None:
+            self.closure_hits += 1
+            return items
         
+        items = {(item.prod, item.dot): item.lookahead for item in kernel}
+        bodies = self.prod_bodies
+        n_terminals = self.n_terminals
+        
+        # Lookahead flowing into each non-terminal after a dot: FIRST(βa)
+        # for each kernel item A -> α.Yβ, a
+        incoming = {}
+        for prod, dot, lookahead in kernel:
+            body = bodies[prod]
+            if dot < len(body) and body[dot] >= n_terminals:
+                incoming[body[dot]] = incoming.get(body[dot], 0) | self.analysis.first_of(body, dot + 1, lookahead)
+        
+        for symbol, lookahead in incoming.items():
+            # With no lookahead (an unproductive context) nothing is added
+            if not lookahead:
+                continue
+            for core, spontaneous, propagates in self.closure_template(symbol):
+                items[core] = items.get(core, 0) | spontaneous | (lookahead if propagates else 0)
+        
+        self.closures[kernel] = items
         return items
     
-    def goto(self, items, symbol):
-        """Compute the goto set for a set of items and a symbol"""
-        initial = []
+    def closure_template(self, symbol):
+        """The items expanding a non-terminal adds, as [(core, spontaneous lookaheads, propagates)]
+        
+        An added item's lookahead is its spontaneous set, plus the lookahead
+        flowing into the non-terminal if it propagates. Templates are made
+        once per non-terminal, by closing its productions over a probe
+        lookahead (the bit just past the terminals).
+        """
+        template = self.closure_templates.get(symbol)
+        if template is None:
+            probe = 1 << self.n_terminals
+            items = self.expand_items({(prod, 0): probe for prod in self.prods_by_head[symbol]})
+            template = self.closure_templates[symbol] = [
+                (core, lookahead & ~probe, bool(lookahead & probe)) for core, lookahead in items.items()]
+        return template
+    
+    def expand_items(self, items):
+        """Close a {(prod, dot): lookahead} map in place by iterating to a fixed point"""
+        bodies = self.prod_bodies
+        n_terminals = self.n_terminals
+        first, nullable = self.analysis.first, self.analysis.nullable
         
-        for i in items:
-            # Skip if dot is at the end
-            if i.index('.') == len(i) - 1:
+        # Items are re-queued whenever their lookahead set grows
+        work = list(items)
+        while work:
+            core = work.pop()
+            prod, dot = core
+            body = bodies[prod]
+            
+            # Skip if dot is at the end or before a terminal
+            if dot == len(body) or body[dot] < n_terminals:
                 continue
             
-            head, body = i.split('->')
-            seen, unseen = body.split('.')
+            # Lookahead for the new items is FIRST(βa) for the item A -> α.Yβ, a
+            lookahead = 0
+            for i in range(dot + 1, len(body)):
+                lookahead |= first[body[i]]
+                if not nullable[body[i]]:
+                    break
+            else:
+                lookahead |= items[core]
             
+            # Add items of the form Y -> .γ to the closure
+            for new_prod in self.prods_by_head[body[dot]]:
+                new_core = (new_prod, 0)
+                old = items.get(new_core, 0)
+                if old | lookahead != old:
+                    items[new_core] = old | lookahead
+                    work.append(new_core)
+        
+        return items
+    
+    def goto(self, items, symbol):
+        """Compute the kernel reached from a closure on a symbol"""
+        kernel = {}
+        bodies = self.prod_bodies
+        
+        for (prod, dot), lookahead in items.items():
+            body = bodies[prod]
             # Check if the next symbol is the one we're looking for
-            if unseen[0] == symbol:
-                initial.append(Item(head + '->' + seen + unseen[0] + '.' + unseen[1:], i.lookahead))
+            if dot < len(body) and body[dot] == symbol:
+                core = (prod, dot + 1)
+                kernel[core] = kernel.get(core, 0) | lookahead
         
-        return self.closure(initial)
+        return tuple(sorted(Item(prod, dot, lookahead) for (prod, dot), lookahead in kernel.items()))
     
     def calc_states(self):
-        """Calculate the collection of sets of LR(1) items"""
-        def contains(states, t):
-            for s in states:
-                if len(s) != len(t):
-                    continue
+        """Calculate the collection of sets of LR(1) items and their transitions"""
+        # Initialize with the closure of {[S' -> .S, $]}
+        start = (Item(0, 0, 1 << self.end_marker),)
+        states = [State(0, start, self.closure(start))]
+        state_index = {start: 0}
+        
+        # The state list doubles as the worklist: each state is expanded
+        # exactly once, and new kernels are appended behind it
+        reused = self.reused_successors
+        for s in states:
+            successors = reused.get(s.kernel)
+            for symbol, kernel in successors if successors is not None else self.successors(s.closure):
+                target = state_index.get(kernel)
+                if target is None:
+                    target = state_index[kernel] = len(states)
+                    states.append(State(target, kernel, self.closure(kernel)))
                 
-                if sorted(s) == sorted(t):
-                    for i in range(len(s)):
-                        if s[i].lookahead != t[i].lookahead:
-                            break
-                    else:
-                        return True
-            
-            return False
+                s.transitions[symbol] = target
         
-        # Get the start symbol and its production
-        head, body = self.production_list[0].split('->')
+        return states
+    
+    def successors(self, items):
+        """Yield (symbol, goto kernel) for each symbol after a dot, in symbol_rank order
         
-        # Initialize with the closure of {[S' -> .S, $]}
-        states = [self.closure([Item(head + '->.' + body, ['$'])])]
+        Equivalent to calling goto for each symbol, in one pass over the items.
+        """
+        bodies = self.prod_bodies
+        advanced = {}
+        for (prod, dot), lookahead in items.items():
+            body = bodies[prod]
+            if dot < len(body):
+                kernel = advanced.setdefault(body[dot], {})
+                kernel[(prod, dot + 1)] = kernel.get((prod, dot + 1), 0) | lookahead
         
-        # Compute the collection of sets of LR(1) items
-        while True:
-            flag = 0
-            for s in states:
-                # For each symbol in the grammar
-                for symbol in list(self.nt_list.keys()) + list(self.t_list.keys()):
-                    # Compute the goto set
-                    t = self.goto(s, symbol)
-                    
-                    # Skip if empty or already in states
-                    if not t or contains(states, t):
-                        continue
-                    
-                    # Add to states
-                    states.append(t)
-                    flag = 1
-            
-            if flag == 0:
-                break
+        for symbol in sorted(advanced, key=self.symbol_rank.__getitem__):
+            yield symbol, tuple(sorted(Item(prod, dot, lookahead)
+                                       for (prod, dot), lookahead in advanced[symbol].items()))
+    
+    def expand_kernel(self, kernel):
+        """A state's closure, successors and reduce entries, as a parallel build worker returns them
         
-        # Convert to State objects
-        State._id = 0
-        return [State(s) for s in states]
+        The reduce entries are one ACTION row and its conflicts, filled in
+        as add_row fills them; they do not depend on the state's number.
+        """
+        closure = self.closure(kernel)
+        row = ParseTable(self.symbols[:self.n_terminals], (), 1, (), ())
+        self.add_reductions(row, 0, closure)
+        return closure, list(self.successors(closure)), row.action.tobytes(), row.conflicts
     
-    def make_table(self, states):
-        """Make the CLR(1) parsing table"""
-        def getstateno(t):
-            for s in states:
-                if len(s.closure) != len(t):
-                    continue
+    def calc_states_parallel(self, workers):
+        """calc_states with each breadth-first frontier expanded over a pool of worker processes
+        
+        Workers encode the grammar once, then return the closures, successors
+        and reduce entries of the kernels they are sent. The coordinator
+        numbers new kernels through one index, taking the frontier in order
+        and each state's successors in symbol order, so states are numbered
+        exactly as calc_states numbers them. Returns the states and the
+        reduce entries made by the workers, by state, for make_table.
+        """
+        start = (Item(0, 0, 1 << self.end_marker),)
+        states = [State(0, start, None)]
+        state_index = {start: 0}
+        reductions = {}
+        reused = self.reused_successors
+        
+        with ProcessPoolExecutor(workers, initializer=init_build_worker, initargs=(self.grammar,)) as pool:
+            first = 0
+            while first < len(states):
+                frontier = states[first:]
+                first = len(states)
+                
+                # Kernels whose successors were kept from an earlier build stay here
+                remote = []
+                if len(frontier) >= PARALLEL_MIN_FRONTIER:
+                    remote = [s for s in frontier if s.kernel not in reused]
+                expanded = {}
+                if remote:
+                    size = -(-len(remote) // (4 * workers))
+                    batches = [remote[i:i + size] for i in range(0, len(remote), size)]
+                    results = pool.map(expand_kernels, [[s.kernel for s in batch] for batch in batches])
+                    for batch, batch_results in zip(batches, results):
+                        for s, (closure, successors, row, conflicts) in zip(batch, batch_results):
+                            expanded[s.no] = closure, successors
+                            reductions[s.no] = row, conflicts
                 
-                if sorted(s.closure) == sorted(t):
-                    for i in range(len(s.closure)):
-                        if s.closure[i].lookahead != t[i].lookahead:
-                            break
+                for s in frontier:
+                    if s.no in expanded:
+                        s.closure, successors = expanded[s.no]
+                        self.closures[s.kernel] = s.closure
                     else:
-                        return s.no
+                        s.closure = self.closure(s.kernel)
+                        successors = reused.get(s.kernel)
+                        if successors is None:
+                            successors = self.successors(s.closure)
+                    
+                    for symbol, kernel in successors:
+                        target = state_index.get(kernel)
+                        if target is None:
+                            target = state_index[kernel] = len(states)
+                            states.append(State(target, kernel, None))
+                        
+                        s.transitions[symbol] = target
+        
+        return states, reductions
+    
+    def closure0(self, kernel):
+        """Compute the LR(0) closure of a kernel of (prod, dot) cores"""
+        items = list(kernel)
+        seen = set(items)
+        expanded = set()
+        bodies = self.prod_bodies
+        
+        for prod, dot in items:
+            body = bodies[prod]
+            if dot == len(body) or body[dot] < self.n_terminals or body[dot] in expanded:
+                continue
             
-            return -1
+            expanded.add(body[dot])
+            for new_prod in self.prods_by_head[body[dot]]:
+                if (new_prod, 0) not in seen:
+                    seen.add((new_prod, 0))
+                    items.append((new_prod, 0))
         
-        def getprodno(closure):
-            closure = ''.join(closure).replace('.', '')
-            return self.production_list.index(closure)
+        return items
+    
+    def calc_lalr_states(self):
+        """Calculate the LALR(1) states by propagating lookaheads over the LR(0) collection"""
+        bodies = self.prod_bodies
         
-        # Initialize the parsing table
-        parsing_table = OrderedDict()
+        # Build the LR(0) collection with the same worklist as calc_states
+        kernels = [((0, 0),)]
+        transitions = [{}]
+        index = {kernels[0]: 0}
         
-        for s in states:
-            parsing_table[s.no] = OrderedDict()
+        for no, kernel in enumerate(kernels):
+            advanced = {}
+            for prod, dot in self.closure0(kernel):
+                if dot < len(bodies[prod]):
+                    advanced.setdefault(bodies[prod][dot], []).append((prod, dot + 1))
             
-            for item in s.closure:
-                head, body = item.split('->')
-                
-                # If item is of the form A -> α.
-                if body == '.':
-                    for term in item.lookahead:
-                        if term not in parsing_table[s.no]:
-                            parsing_table[s.no][term] = {'r' + str(getprodno(item))}
-                        else:
-                            parsing_table[s.no][term] |= {'r' + str(getprodno(item))}
-                    continue
-                
-                # Get the symbol after the dot
-                nextsym = body.split('.')[1]
+            for symbol in sorted(advanced, key=self.symbol_rank.__getitem__):
+                target_kernel = tuple(sorted(advanced[symbol]))
+                target = index.get(target_kernel)
+                if target is None:
+                    target = index[target_kernel] = len(kernels)
+                    kernels.append(target_kernel)
+                    transitions.append({})
                 
-                # If item is of the form A -> α.β where β is not empty
-                if nextsym:
-                    nextsym = nextsym[0]
-                    t = self.goto(s.closure, nextsym)
-                    
-                    if t:
-                        # If nextsym is a terminal, add shift action
-                        if nextsym in self.t_list:
-                            if nextsym not in parsing_table[s.no]:
-                                parsing_table[s.no][nextsym] = {'s' + str(getstateno(t))}
-                            else:
-                                parsing_table[s.no][nextsym] |= {'s' + str(getstateno(t))}
-                        # If nextsym is a non-terminal, add goto action
-                        else:
-                            parsing_table[s.no][nextsym] = str(getstateno(t))
+                transitions[no][symbol] = target
+        
+        # Close each kernel item over a dummy lookahead '#' (the bit just past
+        # the terminals): lookaheads other than '#' reaching a goto item are
+        # generated spontaneously, '#' means the item's own set propagates
+        probe = 1 << self.n_terminals
+        lookaheads = [dict.fromkeys(kernel, 0) for kernel in kernels]
+        lookaheads[0][(0, 0)] = 1 << self.end_marker
+        links = {}
+        
+        for no, kernel in enumerate(kernels):
+            for core in kernel:
+                for (prod, dot), lookahead in self.closure((Item(core[0], core[1], probe),)).items():
+                    if dot == len(bodies[prod]):
+                        continue
                     
-                    continue
-                
-                # If item is of the form A -> α., it's a reduction item
-                # If it's the augmented start production, add accept action
-                if getprodno(item) == 0:
-                    parsing_table[s.no]['$'] = 'accept'
-                else:
-                    for term in item.lookahead:
-                        if term not in parsing_table[s.no]:
-                            parsing_table[s.no][term] = {'r' + str(getprodno(item))}
-                        else:
-                            parsing_table[s.no][term] |= {'r' + str(getprodno(item))}
+                    target = transitions[no][bodies[prod][dot]]
+                    target_core = (prod, dot + 1)
+                    lookaheads[target][target_core] |= lookahead & ~probe
+                    if lookahead & probe:
+                        links.setdefault((no, core), []).append((target, target_core))
         
-        return parsing_table
+        # Propagate along the links until no lookahead set grows
+        work = [(no, core) for no, kernel in enumerate(kernels) for core in kernel if lookaheads[no][core]]
+        while work:
+            no, core = work.pop()
+            lookahead = lookaheads[no][core]
+            for target, target_core in links.get((no, core), ()):
+                old = lookaheads[target][target_core]
+                if old | lookahead != old:
+                    lookaheads[target][target_core] = old | lookahead
+                    work.append((target, target_core))
+        
+        # Close the LR(1) kernels to get the items make_table reduces on
+        states = []
+        for no, kernel in enumerate(kernels):
+            lr1_kernel = tuple(Item(prod, dot, lookaheads[no][(prod, dot)]) for prod, dot in kernel)
+            state = State(no, lr1_kernel, self.closure(lr1_kernel))
+            state.transitions = transitions[no]
+            states.append(state)
+        
+        return states
     
-    def count_conflicts(self):
+    def build_states(self, mode):
+        """Build the CLR(1) or LALR(1) collection for the encoded grammar"""
+        if mode == 'clr':
+            return self.calc_states()
+        if mode == 'lalr':
+            return self.calc_lalr_states()
+        raise ValueError(f"Unknown table construction mode: {mode!r} (expected 'clr' or 'lalr')")
+    
+    def make_table(self, states, reductions=None):
+        """Make the compiled CLR(1) parsing table
+        
+        reductions holds the reduce entries of a parallel build, by state.
+        """
+        n_terminals = self.n_terminals
+        table = ParseTable(self.symbols[:n_terminals], self.symbols[n_terminals:], len(states),
+                           [head - n_terminals for head in self.prod_heads],
+                           [len(body) for body in self.prod_bodies])
+        for s in states:
+            self.add_row(table, s, reductions.get(s.no) if reductions else None)
+        return table
+    
+    def add_row(self, table, s, reductions=None):
+        """Fill in the actions and gotos of one state, given its reduce entries if a worker made them"""
+        n_terminals = self.n_terminals
+        
+        # A worker's row goes in before the shifts: add_action keeps every
+        # candidate of a cell, so the result does not depend on the order
+        if reductions is not None:
+            row, conflicts = reductions
+            table.action[s.no * n_terminals:(s.no + 1) * n_terminals] = array('i', row)
+            for (_, column), actions in conflicts.items():
+                table.conflicts[(s.no, column)] = actions
+        
+        # Shifts and gotos come straight from the recorded transitions
+        for symbol, target in s.transitions.items():
+            if symbol < n_terminals:
+                table.add_action(s.no, symbol, encode_shift(target))
+            else:
+                table.set_goto(s.no, symbol - n_terminals, target)
+        
+        if reductions is None:
+            self.add_reductions(table, s.no, s.closure)
+    
+    def add_reductions(self, table, no, closure):
+        """Fill in the reductions of a state from the completed items A -> α. of its closure"""
+        for (prod, dot), lookahead in closure.items():
+            if dot != len(self.prod_bodies[prod]):
+                continue
+            
+            # If it's the augmented start production, add accept action
+            if prod == 0:
+                table.set_accept(no, self.end_marker)
+            else:
+                for term in iter_bits(lookahead):
+                    table.add_action(no, term, encode_reduce(prod))
+    
+    @property
+    def parsing_table(self):
+        """The {state: {symbol: action}} view of the compiled table"""
+        self.finish_table()
+        if self.table is None:
+            return OrderedDict()
+        if self._table_view is None:
+            self._table_view = self.table.to_dict()
+        return self._table_view
+    
+    def count_conflicts(self, table=None):
         """Count shift/reduce and reduce/reduce conflicts in the parsing table"""
-        sr, rr = 0, 0
+        if table is None:
+            self.finish_table()
+            table = self.table
+        if table is None:
+            return {'s/r': 0, 'r/r': 0}
+        return table.count_conflicts()
+    
+    def recognize(self, input_string):
+        """Check whether the input string is accepted, without recording any steps"""
+        return self.recognize_tokens(self.tokenize(input_string), len(input_string))
+    
+    def recognize_tokens(self, tokens, end, states=None, step_count=0, shifted=None, reduced=None):
+        """The driver loop of every deterministic parse, over (column, start offset, end offset) tokens
         
-        for state, actions in self.parsing_table.items():
-            for symbol, action in actions.items():
-                if isinstance(action, set) and len(action) > 1:
-                    action_list = list(action)
-                    r_count = sum(1 for a in action_list if a[0] == 'r')
-                    s_count = sum(1 for a in action_list if a[0] == 's')
-                    
-                    if r_count > 0 and s_count > 0:
-                        sr += 1
-                    elif r_count > 1:
-                        rr += 1
+        The end marker is supplied at offset `end` once the tokens run out.
+        With end=None the tokens are only part of the input: running out of
+        them returns a result with accepted=None, and `states` is left ready
+        for more. shifted(token, target) and reduced(prod, target, pos) are
+        called after each step, with pos the offset of the lookahead.
         
-        return {'s/r': sr, 'r/r': rr}
+        On a cyclic grammar (A =>+ A) the resolved table can reduce forever
+        without shifting. No acyclic run needs more reductions in a row
+        than `limit` per stacked state, so going over that raises ValueError.
+        """
+        table = self.table
+        action_at, goto_at = table.action_at, table.goto_at
+        prod_lengths, prod_heads = table.prod_lengths, table.prod_heads
+        n_terminals = self.n_terminals
+        limit = table.n_states + len(prod_lengths)
+        
+        if states is None:
+            states = array('i', [0])
+        if end is not None:
+            tokens = itertools.chain(tokens, [(self.end_marker, end, end)])
+        
+        for token in tokens:
+            column, pos, stop = token
+            action = action_at(states[-1], column) if column < n_terminals else ERROR
+            budget = limit * len(states)
+            
+            # Reduce: pop the body's states and push the goto state
+            while action < -1:
+                prod = -action - 1
+                if prod_lengths[prod]:
+                    del states[-prod_lengths[prod]:]
+                states.append(goto_at(states[-1], prod_heads[prod]))
+                step_count += 1
+                if reduced is not None:
+                    reduced(prod, states[-1], pos)
+                budget -= 1
+                if budget < 0:
+                    raise ValueError(f"The parser keeps reducing without shifting the symbol at offset {pos}: "
+                                     f"the grammar is cyclic (a non-terminal derives itself)")
+                action = action_at(states[-1], column)
+            
+            if action > 0:
+                # Shift: push the target state and move to the next symbol
+                states.append(action - 1)
+                step_count += 1
+                if shifted is not None:
+                    shifted(token, action - 1)
+            elif action == ACCEPT and pos == end:
+                return ParseResult(True, step_count=step_count)
+            else:
+                return ParseResult(False, error_position=pos, step_count=step_count)
+        
+        return ParseResult(None, step_count=step_count)
     
-    def parse_input(self, input_string):
-        """Parse an input string using the CLR parsing table"""
-        # Add end marker to input
-        input_string = input_string + '$'
-        input_chars = list(input_string)
+    def parse_tree(self, input_string):
+        """Parse an input string and record its parse tree in a ParseTree, without a trace"""
+        prod_lengths = self.table.prod_lengths
+        tree = ParseTree(self, input_string)
+        rules, starts, ends, children = tree.rules, tree.starts, tree.ends, tree.children
+        add_rule, add_first, add_count = rules.append, tree.first_child.append, tree.child_count.append
+        add_start, add_end = starts.append, ends.append
+        nodes = array('i')        # node of each stacked symbol, parallel to the state stack
         
-        # Initialize stack with state 0
-        stack = ['0']
-        self.parsing_steps = []
-        self.parsing_steps.append({'stack': ''.join(stack), 'input': ''.join(input_chars), 'action': 'start'})
+        def shifted(token, target):
+            # The token becomes a leaf
+            column, start, stop = token
+            nodes.append(len(rules))
+            add_rule(-column - 1)
+            add_first(len(children))
+            add_count(0)
+            add_start(start)
+            add_end(stop)
         
-        try:
-            while input_chars:
-                # Get current state and input symbol
-                current_state = int(stack[-1])
-                current_symbol = input_chars[0]
-                
-                # Check if action exists for this state and symbol
-                if current_symbol not in self.parsing_table[current_state]:
-                    self.is_accepted = False
-                    self.parsing_steps.append({'stack': ''.join(stack), 'input': ''.join(input_chars), 'action': 'reject'})
-                    return False
-                
-                # Get action
-                action = self.parsing_table[current_state][current_symbol]
-                
-                # Handle different action types
-                if isinstance(action, set):
-                    # In case of conflict, take the first action
-                    action = next(iter(action))
-                
-                if action == 'accept':
-                    # Make sure we've fully consumed the input (should just be '$' left)
-                    if len(input_chars) == 1 and input_chars[0] == '$':
-                        # Accept the input
-                        self.is_accepted = True
-                        self.parsing_steps.append({'stack': ''.join(stack), 'input': ''.join(input_chars), 'action': 'accept'})
-                        return True
-                    else:
-                        self.is_accepted = False
-                        self.parsing_steps.append({'stack': ''.join(stack), 'input': ''.join(input_chars), 'action': 'reject'})
-                        return False
-                
-                elif action.startswith('s'):
-                    # Shift action - add action info before modifying stack/input
-                    action_info = f"shift({action[1:]})"
-                    
-                    # Shift action
-                    stack.append(current_symbol)
-                    stack.append(action[1:])
-                    input_chars = input_chars[1:]
-                    self.parsing_steps.append({'stack': ''.join(stack), 'input': ''.join(input_chars), 'action': action_info})
-                
-                elif action.startswith('r'):
-                    # Reduce action - capture info before modifying stack
-                    prod_idx = int(action[1:])
-                    prod = self.production_list[prod_idx]
-                    # Include the rule number in the action info
-                    action_info = f"reduce({prod},r{prod_idx})"
-                    
-                    # Reduce action
-                    head, body = prod.split('->')
-                    
-                    # Pop 2*len(body) symbols from the stack
-                    pop_count = 2 * len(body) if body else 0
-                    stack = stack[:-pop_count] if pop_count > 0 else stack
-                    
-                    # Get the goto state
-                    goto_state = self.parsing_table[int(stack[-1])][head]
+        def reduced(prod, target, pos):
+            # The body's nodes become the children of a new node
+            length = prod_lengths[prod]
+            node = len(rules)
+            add_rule(prod)
+            add_first(len(children))
+            add_count(length)
+            if length:
+                children.extend(nodes[-length:])
+                add_start(starts[nodes[-length]])
+                add_end(ends[nodes[-1]])
+                del nodes[-length:]
+            else:
+                add_start(pos)
+                add_end(pos)
+            nodes.append(node)
+        
+        result = self.recognize_tokens(self.tokenize(input_string), len(input_string),
+                                       shifted=shifted, reduced=reduced)
+        if result.accepted:
+            result.tree = tree
+        return result
+    
+    def parse_glr(self, input_string):
+        """Parse following every conflicting action, on a graph-structured stack (GLR)
+        
+        All stacks alive at a token share one GSS level, and all parses share
+        one packed forest, so ambiguous grammars stay polynomial. The result
+        carries the forest and stats: the number of parses, the GSS nodes and
+        edges created, and the widest GSS level.
+        """
+        table = self.table
+        actions_at, goto_at = table.actions_at, table.goto_at
+        prod_lengths, goto_columns = table.prod_lengths, table.prod_heads
+        prod_heads, n_terminals, end_marker = self.prod_heads, self.n_terminals, self.end_marker
+        
+        forest = ParseForest(self, input_string)
+        end = len(input_string)
+        tokens = itertools.chain(self.tokenize(input_string), [(end_marker, end, end)])
+        frontier = {0: GSSNode(0, 0)}   # GSS nodes of the current level, by state
+        stats = {'parses': 0, 'gss_nodes': 1, 'gss_edges': 0, 'peak_frontier': 1}
+        step_count = 0
+        
+        def reductions(node, column, via=None):
+            return [(node, -action - 1, via) for action in actions_at(node.state, column)
+                    if action < -1 and (via is None or prod_lengths[-action - 1])]
+        
+        for level, (column, start, token_end) in enumerate(tokens):
+            forest.starts.append(start)
+            forest.ends.append(token_end)
+            if column >= n_terminals:
+                return ParseResult(False, error_position=start, step_count=step_count, stats=stats)
+            
+            # Reduce until no new node or edge appears at this level
+            worklist = [item for node in frontier.values() for item in reductions(node, column)]
+            while worklist:
+                node, prod, via = worklist.pop()
+                for below, labels in self.gss_paths(node, prod_lengths[prod], via):
+                    symbol_node = (prod_heads[prod], below.level, level)
+                    forest.add(symbol_node, prod, labels)
+                    step_count += 1
                     
-                    # Push the non-terminal and new state
-                    stack.append(head)
-                    stack.append(goto_state)
-                    self.parsing_steps.append({'stack': ''.join(stack), 'input': ''.join(input_chars), 'action': action_info})
-                
-                else:
-                    # Goto action (shouldn't happen here)
-                    self.is_accepted = False
-                    self.parsing_steps.append({'stack': ''.join(stack), 'input': ''.join(input_chars), 'action': 'error'})
-                    return False
+                    target = goto_at(below.state, goto_columns[prod])
+                    reached = frontier.get(target)
+                    if reached is None:
+                        reached = frontier[target] = GSSNode(target, level)
+                        reached.edges[below] = symbol_node
+                        stats['gss_nodes'] += 1
+                        stats['gss_edges'] += 1
+                        worklist.extend(reductions(reached, column))
+                    elif below not in reached.edges:
+                        # A new edge into a node already reduced from opens
+                        # new reduction paths through it, from any node here
+                        reached.edges[below] = symbol_node
+                        stats['gss_edges'] += 1
+                        for other in frontier.values():
+                            worklist.extend(reductions(other, column, (reached, below)))
             
-            # If we've consumed all input but haven't reached 'accept', it's an error
-            self.is_accepted = False
-            self.parsing_steps.append({'stack': ''.join(stack), 'input': ''.join(input_chars), 'action': 'reject'})
-            return False
+            stats['peak_frontier'] = max(stats['peak_frontier'], len(frontier))
+            
+            if column == end_marker:
+                if any(ACCEPT in actions_at(node.state, column) for node in frontier.values()):
+                    forest.root = (self.prod_bodies[0][0], 0, level)
+                    stats['parses'] = forest.count()
+                    result = ParseResult(True, step_count=step_count, stats=stats)
+                    result.forest = forest
+                    return result
+                return ParseResult(False, error_position=start, step_count=step_count, stats=stats)
+            
+            # Shift the token from every node that can
+            shifted = {}
+            leaf = (column, level, level + 1)
+            for node in frontier.values():
+                for action in actions_at(node.state, column):
+                    if action > 0:
+                        target = shifted.get(action - 1)
+                        if target is None:
+                            target = shifted[action - 1] = GSSNode(action - 1, level + 1)
+                            stats['gss_nodes'] += 1
+                        target.edges[node] = leaf
+                        stats['gss_edges'] += 1
+                        step_count += 1
+            
+            if not shifted:
+                return ParseResult(False, error_position=start, step_count=step_count, stats=stats)
+            frontier = shifted
+    
+    def gss_paths(self, node, length, via=None):
+        """(bottom node, edge labels in input order) for each GSS path of a length down from node
         
-        except Exception as e:
-            print(f"Error during parsing: {e}")
-            self.is_accepted = False
-            return False
+        With via=(upper, lower), only the paths that use that edge are
+        returned. They are built around the edge rather than filtered out
+        of all the paths: each way down from node to upper that does not
+        use the edge (only same-level edges can lead there) is joined to
+        each way down from lower. Labels are linked (label, rest) pairs
+        until the end, so extending a path does not copy it.
+        """
+        if via is None:
+            return [(below, unlink_labels(labels)) for below, labels in self.gss_walk(node, length, ())]
+        
+        upper, lower = via
+        paths = []
+        prefixes = [(node, 0, ())]
+        while prefixes:
+            current, depth, labels = prefixes.pop()
+            if current is upper:
+                for below, path in self.gss_walk(lower, length - depth - 1, (upper.edges[lower], labels)):
+                    paths.append((below, unlink_labels(path)))
+            if depth < length - 1:
+                prefixes.extend((below, depth + 1, (label, labels)) for below, label in current.edges.items()
+                                if below.level == upper.level and not (current is upper and below is lower))
+        return paths
+    
+    def gss_walk(self, node, length, labels):
+        """(bottom node, linked labels) for each GSS path of a length down from node, after `labels`"""
+        paths = [(node, labels)]
+        for _ in range(length):
+            paths = [(below, (label, path)) for current, path in paths for below, label in current.edges.items()]
+        return paths
+    
+    def tokenize(self, input_string):
+        """Yield (column, start, end) for each input symbol, through the lexer if there is one"""
+        if self.lexer is not None:
+            return self.lexer.tokens(input_string)
+        columns = map(self.symbol_index.get, input_string, itertools.repeat(self.n_terminals))
+        return zip(columns, itertools.count(), itertools.count(1))
     
-    def initialize_parser(self, grammar):
-        """Initialize the parser with a grammar"""
+    def parse(self, input_string, trace=False, max_steps=None, tree=False):
+        """Parse an input string into a ParseResult, leaving the parser untouched
+        
+        By default the input is only recognized, in linear time. With
+        trace=True every step is recorded in the result, keeping at most
+        max_steps of them. With tree=True an accepted input also gets its
+        ParseTree. Grammars with a token section are scanned by the lexer in
+        the same pass and also accept bytes, memoryview or mmap input.
+        """
+        if tree:
+            tree_result = self.parse_tree(input_string)
+            if not trace:
+                return tree_result
+            result = self.parse(input_string, trace, max_steps)
+            result.tree = tree_result.tree
+            return result
+        
+        if not trace:
+            return self.recognize(input_string)
+        
+        if not isinstance(input_string, str):
+            input_string = bytes(input_string).decode('utf-8')
+        
+        steps = []
+        truncated = False
+        pending = []               # index of a shift step still waiting for its input
+        prod_lengths = self.table.prod_lengths
+        stack = ['0']              # display form of the stack
+        
+        def remaining(pos):
+            if end - pos > TRACE_WINDOW:
+                return input_string[pos:pos + TRACE_WINDOW] + '…'
+            return input_string[pos:] + '$'
+        
+        def record(action, pos):
+            # Once the trace is full, finish without recording
+            nonlocal truncated
+            if pending:
+                # A shift is only shown once the next symbol is known
+                steps[pending.pop()]['input'] = remaining(pos)
+            if max_steps is not None and len(steps) >= max_steps:
+                truncated = True
+            else:
+                shown = ''.join(stack) if len(stack) <= TRACE_WINDOW else '…' + ''.join(stack[-TRACE_WINDOW:])
+                steps.append({'stack': shown, 'input': remaining(pos), 'action': action})
+        
+        def shifted(token, target):
+            stack.append(self.symbols[token[0]])
+            stack.append(str(target))
+            record(f"shift({target})", token[1])
+            if not truncated:
+                pending.append(len(steps) - 1)
+        
+        def reduced(prod, target, pos):
+            # Pop the body's symbols and push the non-terminal and the goto state
+            if prod_lengths[prod]:
+                del stack[-2 * prod_lengths[prod]:]
+            stack.append(self.symbols[self.prod_heads[prod]])
+            stack.append(str(target))
+            # Include the rule number in the action info
+            record(f"reduce({self.production_list[prod]},r{prod})", pos)
+        
+        end = len(input_string)
+        tokens = self.tokenize(input_string)
+        first = next(tokens, (self.end_marker, end, end))
+        steps.append({'stack': '0', 'input': remaining(first[1]), 'action': 'start'})
+        
+        result = self.recognize_tokens(itertools.chain([first], tokens), end, shifted=shifted, reduced=reduced)
+        if result.accepted:
+            # Accept only once the input is fully consumed
+            record('accept', end)
+        else:
+            # No action for this state and symbol
+            record('reject', result.error_position)
+        result.steps, result.truncated = steps, truncated
+        return result
+    
+    def incremental(self):
+        """Start a push-style parse of input that arrives in chunks"""
+        return IncrementalParser(self)
+    
+    def parse_input(self, input_string, trace=False, max_steps=None):
+        """Parse an input string, keeping the outcome on the parser for get_result"""
+        result = self.parse(input_string, trace, max_steps)
+        self.is_accepted = result.accepted
+        self.parsing_steps = result.steps
+        self.trace_truncated = result.truncated
+        self.error_position = result.error_position
+        return result.accepted
+    
+    def initialize_parser(self, grammar, mode='clr', compress=False, lazy=False, base=None, workers=None,
+                          minimize=False, unit_rules=False):
+        """Initialize the parser with a grammar, building CLR(1) or LALR(1) tables
+        
+        With lazy=True the CLR(1) states are only built as parsing reaches
+        them; finish_table() builds the rest. base is a parser built for an
+        earlier version of the grammar: the sets, closures and successors
+        the edit leaves unchanged are taken from it, and the result is the
+        same as a full build. With workers, the CLR(1) states and their
+        reductions are built by that many worker processes; the states and
+        table are the same as a serial build's. minimize and unit_rules run
+        minimize_table() on the finished table.
+        """
+        if lazy and (mode != 'clr' or compress or minimize or unit_rules):
+            raise ValueError("Lazy tables are only available unminimized and uncompressed, in 'clr' mode")
+        if workers and (mode != 'clr' or lazy):
+            raise ValueError("Parallel builds are only available for eager tables, in 'clr' mode")
+        
+        self.build_timings = OrderedDict()
+        started = time.perf_counter()
+        
         # Parse the grammar
         self.parse_grammar(grammar)
-        
-        # Compute FIRST and FOLLOW sets for all non-terminals
-        for nt in self.nt_list:
-            self.compute_first(nt)
-            self.compute_follow(nt)
+        started = self.record_phase('parse_grammar', started)
         
         # Augment the grammar
         self.augment_grammar()
+        self.encode_grammar()
+        
+        # Compute FIRST and FOLLOW sets for all non-terminals
+        edit = GrammarEdit(base, self) if base is not None else None
+        if edit is not None and not edit.compatible:
+            edit = None
+        self.compute_first_follow(edit)
+        started = self.record_phase('first_follow', started)
         
-        # Calculate states
-        states = self.calc_states()
+        # Take what the edit leaves unchanged from the earlier build
+        if edit is not None:
+            self.reused_closures, self.reused_states = edit.seed()
+            started = self.record_phase('reuse', started)
+        
+        # Calculate states, or only the start state in lazy mode
+        self.mode = mode
+        self._table_view = None
+        if lazy:
+            self.table = LazyParseTable(self)
+            self.states = self.table.states
+            self.record_phase('states', started)
+            return
+        reductions = None
+        if workers:
+            self.states, reductions = self.calc_states_parallel(workers)
+        else:
+            self.states = self.build_states(mode)
+        started = self.record_phase('states', started)
+        
+        # Create parsing table, optionally packed with row displacement
+        self.table = self.make_table(self.states, reductions)
+        started = self.record_phase('table', started)
+        
+        if minimize or unit_rules:
+            self.minimize_table(unit_rules)
+            started = self.record_phase('minimize', started)
+        if compress:
+            self.table = self.table.compress()
+            self.record_phase('table', started)
+    
+    def record_phase(self, phase, started):
+        """Add the time since `started` to a build phase and return the current time"""
+        now = time.perf_counter()
+        self.build_timings[phase] = self.build_timings.get(phase, 0.0) + now - started
+        return now
+    
+    def get_build_stats(self):
+        """Build time per phase, in seconds, and the sizes that drive it"""
+        return {
+            'phases': dict(self.build_timings),
+            'states': self.table.n_states if self.table is not None else 0,
+            'items': sum(len(s.closure or ()) for s in self.states),
+            'closure_calls': self.closure_calls,
+            'closure_cache_hits': self.closure_hits,
+            'reused_closures': self.reused_closures,
+            'reused_states': self.reused_states
+        }
+    
+    def recompile(self, added=(), removed=()):
+        """A new parser for the grammar with `removed` productions dropped and `added` ones appended
         
-        # Create parsing table
-        self.parsing_table = self.make_table(states)
+        Only what the edit can change is rebuilt; this parser is left as it is.
+        """
+        grammar = edit_grammar(self.grammar, added, removed)
+        minimized = self.minimize_stats is not None
+        return compile_grammar(grammar, self.mode, isinstance(self.table, CompressedParseTable), base=self,
+                               minimize=minimized, unit_rules=minimized and self.minimize_stats['unit_rules'])
+    
+    def finish_table(self):
+        """Build the rest of a lazy table, giving the same states and table as an eager build"""
+        if isinstance(self.table, LazyParseTable):
+            started = time.perf_counter()
+            self.states = self.table.finish()
+            started = self.record_phase('states', started)
+            self.table = self.make_table(self.states)
+            self.record_phase('table', started)
+            self._table_view = None
+    
+    def minimize_table(self, unit_rules=False):
+        """Replace the table with its minimized form and return the state and entry counts before and after
+        
+        See ParseTable.minimize. With unit_rules, the unit productions A -> B
+        are bypassed, so the driver takes fewer steps but traces and trees
+        leave those reductions out. The states collection is left as built.
+        """
+        self.finish_table()
+        units = [prod for prod, body in enumerate(self.prod_bodies)
+                 if prod and len(body) == 1 and body[0] >= self.n_terminals] if unit_rules else ()
+        before = self.table.entry_counts()
+        self.table, bypassed, defaults = self.table.minimize(units)
+        self._table_view = None
+        self.minimize_stats = OrderedDict([
+            ('before', before),
+            ('after', self.table.entry_counts()),
+            ('default_reductions', defaults),
+            ('unit_rules', bool(unit_rules)),
+            ('bypassed_gotos', bypassed)
+        ])
+        return self.minimize_stats
+    
+    def compare_modes(self):
+        """Compare state counts and conflicts of the CLR(1) and LALR(1) tables for the grammar
+        
+        The other mode's table is built by a separate parser, so this one's
+        memos are not touched; the comparison is kept for later calls.
+        """
+        if self.mode_comparison is not None:
+            return self.mode_comparison
+        
+        self.finish_table()
+        other = 'lalr' if self.mode == 'clr' else 'clr'
+        other_parser = compile_grammar(self.grammar, other)
+        
+        states = {self.mode: self.table.n_states, other: other_parser.table.n_states}
+        conflicts = {self.mode: self.count_conflicts(), other: other_parser.count_conflicts()}
+        
+        self.mode_comparison = {
+            'clr_states': states['clr'],
+            'lalr_states': states['lalr'],
+            'state_reduction': states['clr'] - states['lalr'],
+            'new_conflicts': {
+                key: max(0, conflicts['lalr'][key] - conflicts['clr'][key]) for key in ('s/r', 'r/r')
+            }
+        }
+        return self.mode_comparison
+    
+    def size_bytes(self):
+        """Rough memory footprint of the compiled grammar, for cache accounting"""
+        if self.table is None:
+            return 0
+        items = sum(len(s.closure or ()) + len(s.kernel) + len(s.transitions) for s in self.states)
+        return self.table.size_bytes() + 100 * items + 200 * len(self.states) + 100 * len(self.production_list)
+    
+    def save(self, path):
+        """Write the compiled table to a versioned .clrt file that load() can memory-map"""
+        self.finish_table()
+        table = self.table
+        meta = {
+            'mode': self.mode,
+            'grammar': self.grammar,
+            'terminals': table.terminals,
+            'nonterminals': table.nonterminals,
+            'n_states': table.n_states,
+            'layout': 'compressed' if isinstance(table, CompressedParseTable) else 'dense',
+            'conflicts': [[state, column, sorted(actions)] for (state, column), actions in table.conflicts.items()],
+            'minimize': self.minimize_stats is not None,
+            'unit_rules': self.minimize_stats is not None and self.minimize_stats['unit_rules'],
+            'minimize_stats': self.minimize_stats,
+            'arrays': {}
+        }
+        
+        sections = []
+        offset = 0
+        for name in table.ARRAYS:
+            data = array('i', getattr(table, name))
+            if sys.byteorder == 'big':
+                data.byteswap()
+            meta['arrays'][name] = [offset, len(data)]
+            sections.append(data.tobytes())
+            offset += -(-len(sections[-1]) // 8) * 8
+        
+        meta_bytes = json.dumps(meta).encode('utf-8')
+        header = TABLE_HEADER.pack(TABLE_MAGIC, TABLE_FORMAT_VERSION, len(meta_bytes)) + meta_bytes
+        
+        with open(path, 'wb') as f:
+            f.write(header + b'\0' * (-len(header) % 8))
+            for section in sections:
+                f.write(section + b'\0' * (-len(section) % 8))
+    
+    def generate_source(self):
+        """Source of a self-contained Python module that parses this grammar with the compiled table"""
+        self.finish_table()
+        table = self.table
+        n_terminals = self.n_terminals
+        
+        # Key each terminal by what the driver sees: the character itself, or
+        # the lexer's group name for it; the end marker is ''
+        if self.lexer is None:
+            keys = list(table.terminals)
+        else:
+            keys = [None] * n_terminals
+            for group, column in self.lexer.columns.items():
+                keys[column] = group
+        keys[self.end_marker] = ''
+        
+        def row(state):
+            entries = {}
+            for column in range(n_terminals):
+                action = table.action_at(state, column)
+                if action > 0:
+                    entries[keys[column]] = action - 1
+                elif action != ERROR:
+                    entries[keys[column]] = ~(-action - 1)
+            return entries
+        
+        def goto_row(state):
+            targets = ((column, table.goto_at(state, column)) for column in range(len(table.nonterminals)))
+            return {column: target for column, target in targets if target >= 0}
+        
+        lines = [GENERATED_HEADER.format(mode=self.mode.upper() + '(1)')]
+        if self.lexer is None:
+            lines.append('import itertools\n')
+        else:
+            lines.append('import re\n')
+            lines.append(f"SOURCE = {self.lexer.source!r}")
+            lines.append(f"SKIP = {frozenset(name for name in self.lexer.pattern.groupindex if name not in self.lexer.columns)!r}")
+        lines.append(f"GRAMMAR = {tuple(self.grammar)!r}")
+        lines.append(f"MODE = {self.mode!r}")
+        lines.append(f"PRODUCTIONS = {tuple(self.production_list)!r}")
+        lines.append(f"REDUCTIONS = {tuple(zip(table.prod_lengths, table.prod_heads))!r}")
+        lines.append('ACTIONS = (\n' + ''.join(f"    {row(state)!r},\n" for state in range(table.n_states)) + ')')
+        lines.append('GOTOS = (\n' + ''.join(f"    {goto_row(state)!r},\n" for state in range(table.n_states)) + ')')
+        lines.append(GENERATED_CHAR_DRIVER if self.lexer is None else GENERATED_TOKEN_DRIVER)
+        return '\n'.join(lines)
+    
+    def generate(self, path):
+        """Write the module from generate_source() to a file"""
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.generate_source())
+    
+    @classmethod
+    def load(cls, path):
+        """Load a .clrt file; the table arrays are memory-mapped views, not copies"""
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        magic, version, meta_length = TABLE_HEADER.unpack_from(data, 0)
+        if magic != TABLE_MAGIC:
+            raise ValueError(f"{path} is not a compiled CLR table file")
+        if version != TABLE_FORMAT_VERSION:
+            raise ValueError(f"{path} has table format version {version}, expected {TABLE_FORMAT_VERSION}")
+        
+        start = TABLE_HEADER.size + meta_length
+        meta = json.loads(data[TABLE_HEADER.size:start])
+        start += -start % 8
+        
+        view = memoryview(data)
+        arrays = {}
+        for name, (offset, length) in meta['arrays'].items():
+            section = view[start + offset:start + offset + 4 * length]
+            if sys.byteorder == 'little':
+                arrays[name] = section.cast('i')
+            else:
+                arrays[name] = array('i', section.tobytes())
+                arrays[name].byteswap()
+        
+        # Symbols and productions are re-derived from the grammar (cheap);
+        # the states and the table itself are not rebuilt
+        parser = cls()
+        started = time.perf_counter()
+        parser.parse_grammar(meta['grammar'])
+        parser.augment_grammar()
+        parser.encode_grammar()
+        parser.compute_first_follow()
+        
+        if parser.symbols != meta['terminals'] + meta['nonterminals']:
+            raise ValueError(f"{path} does not match the symbols of its own grammar")
+        
+        table_class = CompressedParseTable if meta['layout'] == 'compressed' else ParseTable
+        conflicts = {(state, column): set(actions) for state, column, actions in meta['conflicts']}
+        parser.mode = meta['mode']
+        parser.table = table_class.from_arrays(meta['terminals'], meta['nonterminals'], meta['n_states'],
+                                               arrays, conflicts)
+        if meta['minimize']:
+            # Kept so that recompile() minimizes the edited grammar the same way
+            parser.minimize_stats = OrderedDict(meta['minimize_stats'], unit_rules=meta['unit_rules'])
+        parser.record_phase('load', started)
+        return parser
     
     def get_first_follow_sets(self):
         """Get FIRST and FOLLOW sets for all non-terminals"""
@@ -483,14 +2495,194 @@ class CLRParser:
         
         return result
     
-    def get_result(self):
-        """Get the complete parsing result"""
-        return {
-            'non_terminals': list(self.nt_list.keys()),
-            'terminals': list(self.t_list.keys()) + ['$'],
-            'first_follow': self.get_first_follow_sets(),
-            'parse_table': self.get_parsing_table(),
-            'parsing_steps': self.parsing_steps,
-            'is_accepted': self.is_accepted,
-            'conflicts': self.count_conflicts()
-        } 
\ No newline at end of file
+    def get_compact_table(self):
+        """The compiled table as a symbol header plus integer matrices, for compact JSON"""
+        self.finish_table()
+        return self.table.to_compact() if self.table is not None else None
+    
+    def get_result(self, result=None, fields=None, table_format='dict'):
+        """Get the parsing result, for the last parse_input or a given ParseResult
+        
+        fields limits the result to the listed keys (see RESULT_FIELDS), and
+        the others are never computed. With table_format='compact' the
+        parse table comes from get_compact_table().
+        """
+        if result is None:
+            result = ParseResult(self.is_accepted, self.parsing_steps, self.trace_truncated, self.error_position)
+        
+        parts = OrderedDict([
+            ('non_terminals', lambda: list(self.nt_list.keys())),
+            ('terminals', lambda: list(self.t_list.keys()) + ['$']),
+            ('first_follow', self.get_first_follow_sets),
+            ('parse_table', self.get_parsing_table if table_format == 'dict' else self.get_compact_table),
+            ('parsing_steps', lambda: result.steps),
+            ('trace_truncated', lambda: result.truncated),
+            ('is_accepted', lambda: result.accepted),
+            ('conflicts', self.count_conflicts),
+            ('mode', lambda: self.mode),
+            ('state_count', lambda: self.table.n_states if self.table is not None else 0)
+        ])
+        return {key: part() for key, part in parts.items() if fields is None or key in fields}
+
+# Source of modules written by CLRParser.generate(): a header, the tables,
+# and one of two drivers specialized for characters or lexer tokens
+GENERATED_HEADER = """\
+\"\"\"{mode} parser for GRAMMAR, generated by standalone_parser; do not edit
+
+parse(text) returns (accepted, error_position). Only the standard library
+is needed, and importing the module does no grammar analysis.
+\"\"\"
+"""
+
+# Actions are per-state dicts keyed by the input symbol ('' at the end of
+# the input): a target state to shift to, or ~production to reduce by, so
+# that -1 (production 0) accepts. Like recognize_tokens, the drivers stop
+# a cyclic grammar's endless run of reductions with a ValueError
+GENERATED_CHAR_DRIVER = """
+def parse(text):
+    \"\"\"Return (accepted, error_position) for a string\"\"\"
+    actions, gotos, reductions = ACTIONS, GOTOS, REDUCTIONS
+    limit = len(actions) + len(reductions)
+    stack = [0]
+    row = actions[0]
+    pos = 0
+    
+    for symbol in itertools.chain(text, ('',)):
+        action = row.get(symbol)
+        budget = limit * len(stack)
+        while action is not None and action < -1:
+            length, head = reductions[~action]
+            if length:
+                del stack[-length:]
+            state = gotos[stack[-1]][head]
+            stack.append(state)
+            row = actions[state]
+            action = row.get(symbol)
+            budget -= 1
+            if budget < 0:
+                raise ValueError("The grammar is cyclic: the parser keeps reducing without shifting")
+        
+        if action is None:
+            return False, pos
+        if action == -1:
+            return True, None
+        stack.append(action)
+        row = actions[action]
+        pos += 1
+"""
+
+GENERATED_TOKEN_DRIVER = """
+PATTERN = re.compile(SOURCE)
+BYTES_PATTERN = re.compile(SOURCE.encode('utf-8'))
+
+def parse(data):
+    \"\"\"Return (accepted, error_position) for a str or bytes-like input\"\"\"
+    actions, gotos, reductions, skip = ACTIONS, GOTOS, REDUCTIONS, SKIP
+    match = PATTERN.match if isinstance(data, str) else BYTES_PATTERN.match
+    limit = len(actions) + len(reductions)
+    stack = [0]
+    row = actions[0]
+    pos, end = 0, len(data)
+    
+    while True:
+        # Scan the next token, skipping whitespace and the like
+        while True:
+            if pos >= end:
+                kind, start = '', end
+                break
+            m = match(data, pos)
+            if m is None or m.end() == pos:
+                return False, pos
+            start, pos = pos, m.end()
+            kind = m.lastgroup
+            if kind not in skip:
+                break
+        
+        action = row.get(kind)
+        budget = limit * len(stack)
+        while action is not None and action < -1:
+            length, head = reductions[~action]
+            if length:
+                del stack[-length:]
+            state = gotos[stack[-1]][head]
+            stack.append(state)
+            row = actions[state]
+            action = row.get(kind)
+            budget -= 1
+            if budget < 0:
+                raise ValueError("The grammar is cyclic: the parser keeps reducing without shifting")
+        
+        if action is None:
+            return False, start
+        if action == -1:
+            return True, None
+        stack.append(action)
+        row = actions[action]
+"""
+
+def compile_grammar(grammar, mode='clr', compress=False, base=None, workers=None, minimize=False, unit_rules=False):
+    """Build a parser for a grammar; a top-level function so worker processes can run it"""
+    parser = CLRParser()
+    parser.initialize_parser(grammar, mode=mode, compress=compress, base=base, workers=workers, minimize=minimize,
+                             unit_rules=unit_rules)
+    return parser
+
+# The encoded grammar of a parallel build, in each of its worker processes
+build_worker = None
+
+def init_build_worker(grammar):
+    """Encode a grammar once, as each worker process of a parallel build starts"""
+    global build_worker
+    build_worker = CLRParser()
+    build_worker.parse_grammar(grammar)
+    build_worker.augment_grammar()
+    build_worker.encode_grammar()
+    build_worker.compute_first_follow()
+
+def expand_kernels(kernels):
+    """CLRParser.expand_kernel for a batch of kernels, in a worker process of a parallel build"""
+    return [build_worker.expand_kernel(kernel) for kernel in kernels]
+
+def main(argv=None):
+    """Command-line entry point: python -m standalone_parser compile|generate grammar.txt -o output"""
+    arg_parser = argparse.ArgumentParser(prog='python -m standalone_parser', description='CLR(1) parser tools')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+    
+    compile_cmd = commands.add_parser('compile', help='precompile a grammar file into a .clrt table file')
+    compile_cmd.add_argument('grammar', help='grammar file, one production per line')
+    compile_cmd.add_argument('-o', '--output', help='output file (default: the grammar file with a .clrt suffix)')
+    compile_cmd.add_argument('--mode', choices=['clr', 'lalr'], default='clr', help='table construction mode')
+    compile_cmd.add_argument('--compress', action='store_true', help='pack the table with row displacement')
+    compile_cmd.add_argument('--workers', type=int, help='build the CLR(1) states with this many processes')
+    compile_cmd.add_argument('--minimize', action='store_true', help='add default reductions and merge identical rows')
+    compile_cmd.add_argument('--unit-rules', action='store_true', help='minimize, and bypass unit productions A -> B')
+    
+    generate_cmd = commands.add_parser('generate', help='write a standalone Python parser module for a grammar file')
+    generate_cmd.add_argument('grammar', help='grammar file, one production per line')
+    generate_cmd.add_argument('-o', '--output', help='output file (default: the grammar file with a .py suffix)')
+    generate_cmd.add_argument('--mode', choices=['clr', 'lalr'], default='clr', help='table construction mode')
+    
+    args = arg_parser.parse_args(argv)
+    
+    with open(args.grammar, encoding='utf-8') as f:
+        grammar = [line.strip() for line in f]
+    
+    if args.command == 'compile':
+        output = args.output or args.grammar.rsplit('.', 1)[0] + '.clrt'
+        parser = compile_grammar(grammar, mode=args.mode, compress=args.compress, workers=args.workers,
+                                 minimize=args.minimize, unit_rules=args.unit_rules)
+        parser.save(output)
+        print(f"{output}: {parser.table.n_states} states, {parser.table.size_bytes()} table bytes, "
+              f"conflicts {parser.count_conflicts()}")
+        if parser.minimize_stats is not None:
+            before, after = parser.minimize_stats['before'], parser.minimize_stats['after']
+            print(', '.join(f"{key} {before[key]} -> {after[key]}" for key in before))
+    
+    elif args.command == 'generate':
+        output = args.output or args.grammar.rsplit('.', 1)[0] + '.py'
+        parser = compile_grammar(grammar, mode=args.mode)
+        parser.generate(output)
+        print(f"{output}: {parser.table.n_states} states, conflicts {parser.count_conflicts()}")
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,11 @@ document.addEventListener('DOMContentLoaded', function() {
     const resultPanel = document.getElementById('result-panel');
     const resultStatus = document.querySelector('.result-status');
     
+    // Grammar fields of the last response, reused while the server's ETag
+    // for them is unchanged
+    let grammarCache = { etag: null, fields: null };
+    const grammarFields = ['non_terminals', 'terminals', 'first_follow', 'parse_table', 'conflicts', 'mode', 'state_count'];
+    
     // Set default grammar example
     grammarInput.value = 'S->CC\nC->cC\nC->d';
     stringInput.value = 'cdcd';
@@ -28,14 +33,20 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         
         // Send request to API
+        const headers = {
+            'Content-Type': 'application/json',
+        };
+        if (grammarCache.etag) {
+            headers['If-None-Match'] = grammarCache.etag;
+        }
         fetch('/parse', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
+            headers: headers,
             body: JSON.stringify({
                 grammar: grammar,
-                input_string: inputString
+                input_string: inputString,
+                build_tree: true,
+                table_format: 'compact'
             }),
         })
         .then(response => {
@@ -44,7 +55,18 @@ document.addEventListener('DOMContentLoaded', function() {
                     throw new Error(err.detail || 'Failed to parse input');
                 });
             }
-            return response.json();
+            return response.json().then(data => {
+                // Merge in the cached grammar fields, or cache the new ones
+                if (response.headers.get('X-Grammar-Fields') === 'not-modified') {
+                    return Object.assign({}, grammarCache.fields, data);
+                }
+                data.parse_table = expandCompactTable(data.parse_table);
+                grammarCache = {
+                    etag: response.headers.get('ETag'),
+                    fields: Object.fromEntries(grammarFields.map(field => [field, data[field]]))
+                };
+                return data;
+            });
         })
         .then(data => {
             // Hide loading
@@ -93,6 +115,9 @@ document.addEventListener('DOMContentLoaded', function() {
         // Display parsing steps
         displayParsingSteps(data.parsing_steps);
         
+        // Display parse tree
+        displayParseTree(data.parse_tree);
+        
         // Display conflicts
         displayConflicts(data.conflicts);
     }
@@ -206,6 +231,48 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Function to expand a compact table (integer action and goto rows) into
+    // the {state: {symbol: action}} view: shifts are s+1, reduces -(p+1),
+    // accept -1 and errors 0; missing gotos are -1
+    function expandCompactTable(compact) {
+        if (!compact) {
+            return {};
+        }
+        
+        const actionName = action => {
+            if (action === -1) {
+                return 'accept';
+            }
+            return action > 0 ? `s${action - 1}` : `r${-action - 1}`;
+        };
+        const conflicts = {};
+        compact.conflicts.forEach(([state, column, actions]) => {
+            conflicts[`${state},${column}`] = actions.map(actionName);
+        });
+        
+        const table = {};
+        compact.action.forEach((row, state) => {
+            const actions = {};
+            row.forEach((action, column) => {
+                const conflict = conflicts[`${state},${column}`];
+                if (conflict) {
+                    actions[compact.terminals[column]] = conflict;
+                } else if (action === -1) {
+                    actions[compact.terminals[column]] = 'accept';
+                } else if (action !== 0) {
+                    actions[compact.terminals[column]] = [actionName(action)];
+                }
+            });
+            compact.goto[state].forEach((target, column) => {
+                if (target >= 0) {
+                    actions[compact.nonterminals[column]] = String(target);
+                }
+            });
+            table[state] = actions;
+        });
+        return table;
+    }
+    
     // Function to display parsing table
     function displayParseTable(parseTable, terminals, nonTerminals) {
         const table = document.getElementById('parsing-table');
@@ -371,6 +438,60 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Function to display the parse tree, rebuilt from its flat node arrays
+    function displayParseTree(tree) {
+        const container = document.getElementById('tree-view');
+        container.innerHTML = '';
+        
+        if (!tree) {
+            container.innerHTML = '<div class="alert alert-secondary">No parse tree: the input was rejected.</div>';
+            return;
+        }
+        
+        // Large trees are cut off rather than freezing the page
+        const maxNodes = 2000;
+        let shown = 0;
+        
+        const rootList = document.createElement('ul');
+        rootList.className = 'parse-tree';
+        container.appendChild(rootList);
+        
+        // Walk with an explicit stack, since deep trees would overflow recursion
+        const stack = [[tree.root, rootList]];
+        while (stack.length > 0 && shown < maxNodes) {
+            const [node, list] = stack.pop();
+            shown++;
+            
+            const item = document.createElement('li');
+            const label = document.createElement('span');
+            label.className = tree.rule[node] < 0 ? 'tree-token' : 'tree-symbol';
+            label.textContent = tree.symbols[tree.symbol[node]];
+            item.appendChild(label);
+            
+            if (tree.rule[node] >= 0) {
+                const rule = document.createElement('span');
+                rule.className = 'tree-rule';
+                rule.textContent = ` r${tree.rule[node]}`;
+                item.appendChild(rule);
+                
+                const childList = document.createElement('ul');
+                item.appendChild(childList);
+                const first = tree.first_child[node];
+                for (let i = first + tree.child_count[node] - 1; i >= first; i--) {
+                    stack.push([tree.children[i], childList]);
+                }
+            }
+            list.appendChild(item);
+        }
+        
+        if (stack.length > 0) {
+            const note = document.createElement('div');
+            note.className = 'text-muted small mt-2';
+            note.textContent = `Showing the first ${maxNodes} of ${tree.rule.length} nodes.`;
+            container.appendChild(note);
+        }
+    }
+    
     // Function to display conflicts
     function displayConflicts(conflicts) {
         const container = document.getElementById('conflicts');
@@ -418,6 +539,7 @@ document.addEventListener('DOMContentLoaded', function() {
         document.getElementById('first-follow-sets').innerHTML = '';
         document.getElementById('parsing-table').innerHTML = '';
         document.getElementById('steps-table').querySelector('tbody').innerHTML = '';
+        document.getElementById('tree-view').innerHTML = '';
         document.getElementById('conflicts').innerHTML = '';
     }
 }); 
\ No newline at end of file
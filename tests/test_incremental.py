@@ -0,0 +1,53 @@
+"""IncrementalParser with a lexer: chunked input must scan like the whole input, in bounded memory"""
+import random
+
+from standalone_parser import Lexer, compile_grammar
+
+GRAMMAR = ['%token NUM \\d+', '%token ID [a-z]+', '%skip \\s+', '%skip //[^\\n]*',
+           'S -> S I', 'S -> I', 'I -> ID = NUM ;']
+
+def feed_chunks(parser, chunks):
+    push = parser.incremental()
+    for chunk in chunks:
+        result = push.feed(chunk)
+        if result is not None:
+            return push, result
+    return push, push.finish()
+
+def test_long_whitespace_run_is_not_held_back():
+    parser = compile_grammar(GRAMMAR)
+    push = parser.incremental()
+    assert push.feed('a = 1 ;') is None
+    for _ in range(4096):
+        assert push.feed(' ' * 64) is None
+        assert len(push.pending) <= 1
+    assert push.feed('b = 2 ;') is None
+    assert push.finish().accepted
+
+def test_token_longer_than_max_token_is_an_error():
+    parser = compile_grammar(GRAMMAR)
+    chunks = ['a = '] + ['7' * 64] * (2 * Lexer.MAX_TOKEN // 64)
+    push, result = feed_chunks(parser, chunks)
+    assert result.accepted is False
+    assert result.error_position == 4
+    assert len(push.pending) <= Lexer.MAX_TOKEN + 64
+
+def test_unmatched_character_fails_in_its_chunk():
+    parser = compile_grammar(GRAMMAR)
+    push = parser.incremental()
+    result = push.feed('a = 1 ; ? ')
+    assert result is not None and result.error_position == 8
+
+def test_chunked_input_matches_whole_input():
+    parser = compile_grammar(GRAMMAR)
+    text = 'a = 1 ; // b = 2 ; c\n  d = 33 ;   // x\n e = 4 ;  '
+    rng = random.Random(2)
+    for trial in range(500):
+        sample = text
+        if trial % 2:
+            k = rng.randrange(len(sample))
+            sample = sample[:k] + rng.choice('/\n =;a1 ') + sample[k:]
+        cuts = sorted(rng.sample(range(1, len(sample)), rng.randrange(0, 12)))
+        _, result = feed_chunks(parser, [sample[a:b] for a, b in zip([0] + cuts, cuts + [len(sample)])])
+        expected = parser.parse(sample)
+        assert (result.accepted, result.error_position) == (expected.accepted, expected.error_position), (sample, cuts)
@@ -0,0 +1,53 @@
+"""The parallel CLR(1) build must give exactly the states and table of calc_states"""
+import pytest
+
+import benchmark
+import standalone_parser
+from standalone_parser import compile_grammar, edit_grammar
+
+GRAMMARS = [
+    ['S->CC', 'C->cC', 'C->d'],
+    ['E->E+T', 'E->T', 'T->T*F', 'T->F', 'F->(E)', 'F->a'],
+    ['S->AaB', 'S->', 'A->BA', 'A->b', 'B->SA', 'B->c'],    # conflicts and empty rules
+    benchmark.FAMILIES['expression'].grammar(6),
+    benchmark.FAMILIES['nullable'].grammar(6),
+    benchmark.FAMILIES['alternation'].grammar(32),
+    benchmark.FAMILIES['right_chain'].grammar(12),
+]
+
+@pytest.fixture(autouse=True)
+def small_frontiers(monkeypatch):
+    # Send every frontier to the workers, not only the wide ones
+    monkeypatch.setattr(standalone_parser, 'PARALLEL_MIN_FRONTIER', 1)
+
+def build_snapshot(parser):
+    table = parser.table
+    return {
+        'states': [(s.no, s.kernel, s.closure, s.transitions) for s in parser.states],
+        'action': list(table.action),
+        'goto': list(table.goto),
+        'conflicts': table.conflicts,
+        'conflict_counts': parser.count_conflicts(),
+    }
+
+@pytest.mark.parametrize('grammar', GRAMMARS)
+@pytest.mark.parametrize('workers', [1, 3])
+def test_parallel_build_matches_serial(grammar, workers):
+    serial = compile_grammar(grammar)
+    parallel = compile_grammar(grammar, workers=workers)
+    assert build_snapshot(parallel) == build_snapshot(serial)
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_parallel_build_matches_serial_compressed(compress):
+    grammar = benchmark.FAMILIES['expression'].grammar(4)
+    serial = compile_grammar(grammar, compress=compress)
+    parallel = compile_grammar(grammar, compress=compress, workers=2)
+    assert parallel.table.to_compact() == serial.table.to_compact()
+
+def test_parallel_recompile_matches_serial():
+    grammar = ['E->E+T', 'E->T', 'T->T*F', 'T->F', 'F->(E)', 'F->a']
+    base = compile_grammar(grammar)
+    edited = edit_grammar(grammar, ['F->-F', 'E->E-T'], ['T->F'])
+    serial = compile_grammar(edited, base=base)
+    parallel = compile_grammar(edited, base=base, workers=2)
+    assert build_snapshot(parallel) == build_snapshot(serial)
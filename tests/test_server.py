@@ -0,0 +1,76 @@
+"""The /parse and /parse/batch endpoints, against an in-process app"""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import server
+
+BUILD_PHASES = ('parse_grammar', 'first_follow', 'states', 'table')
+
+@pytest.fixture(autouse=True)
+def fresh_server(monkeypatch):
+    # An empty cache, and builds in threads so no worker processes start
+    monkeypatch.setattr(server, 'grammar_cache', server.GrammarCache())
+    monkeypatch.setattr(server, 'build_flight', server.SingleFlight())
+    pool = server.BuildPool(kind='thread', workers=2)
+    monkeypatch.setattr(server, 'build_pool', pool)
+    yield
+    pool.shutdown()
+
+def timed_phases(response):
+    return [part.split(';')[0].strip() for part in response.headers['Server-Timing'].split(',')]
+
+async def post_together(*bodies):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        return await asyncio.gather(*(client.post('/parse', json=body) for body in bodies))
+
+def test_shared_build_phases_go_to_the_builder_only():
+    body = {'grammar': ['E->E+T', 'E->T', 'T->T*F', 'T->F', 'F->(E)', 'F->a'], 'input_string': 'a+a',
+            'timings': True}
+    responses = asyncio.run(post_together(body, body, body))
+    by_status = {}
+    for response in responses:
+        assert response.status_code == 200
+        by_status.setdefault(response.headers['X-Grammar-Cache'], []).append(response)
+    assert len(by_status['miss']) == 1 and len(by_status['shared']) == 2
+
+    assert set(BUILD_PHASES) <= set(timed_phases(by_status['miss'][0]))
+    for response in by_status['shared']:
+        assert not set(BUILD_PHASES) & set(timed_phases(response))
+        assert not set(BUILD_PHASES) & set(response.json()['timings']['phases_ms'])
+
+    # A later request for the same grammar is a plain hit
+    hit, = asyncio.run(post_together(body))
+    assert hit.headers['X-Grammar-Cache'] == 'hit'
+    assert not set(BUILD_PHASES) & set(timed_phases(hit))
+
+BATCH_GRAMMAR = ['E->E+T', 'E->T', 'T->T*F', 'T->F', 'F->(E)', 'F->a']
+BATCH_INPUTS = ['a+a*a', 'a+', '(a)*a', 'a)'] * 300
+
+async def post_batch(body):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        response = await client.post('/parse/batch', json=body)
+        return [json.loads(line) for line in response.text.splitlines()]
+
+@pytest.mark.parametrize('kind', ['thread', 'process'])
+def test_parallel_batch_matches_serial(monkeypatch, kind):
+    pool = server.BuildPool(kind=kind, workers=2)
+    monkeypatch.setattr(server, 'build_pool', pool)
+    try:
+        body = {'grammar': BATCH_GRAMMAR, 'inputs': BATCH_INPUTS}
+        serial = asyncio.run(post_batch(body))
+        parallel = asyncio.run(post_batch(dict(body, parallel=True)))
+    finally:
+        pool.shutdown()
+    assert [line['index'] for line in serial] == list(range(len(BATCH_INPUTS)))
+    assert parallel == serial
+
+def test_batch_chunks_respect_the_queue_bound(monkeypatch):
+    monkeypatch.setattr(server.build_pool, 'max_queue', 1)
+    lines = asyncio.run(post_batch({'grammar': BATCH_GRAMMAR, 'inputs': BATCH_INPUTS, 'parallel': True}))
+    assert 'error' in lines[-1]
+    assert [line['index'] for line in lines[:-1]] == list(range(len(lines) - 1))